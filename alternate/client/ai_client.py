@@ -0,0 +1,219 @@
+# HTTP client for the client -> AI server hop
+#
+# ai_process used to call requests.post with no session and no timeout, so
+# every turn paid a new TCP handshake to the laptop and a hung server hung
+# the turn with it. Requests now share one keep-alive session, have connect
+# and read timeouts, retry transient failures with jittered backoff, and go
+# through a circuit breaker: after several failures in a row the client
+# fails fast for a while instead of making every turn wait out the timeout.
+#
+# stream() does the same against the NDJSON endpoint and yields tokens as
+# the server forwards them; retries only happen before the first byte.
+import time
+import json
+import random
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import RollingStats, Histogram
+
+CONNECT_TIMEOUT = 3.0        # seconds; the server is on the local network
+READ_TIMEOUT = 60.0          # the LLM behind it can be slow, but not this slow
+RETRIES = 2                  # extra attempts after the first
+BACKOFF = 0.5                # seconds; attempt n waits up to BACKOFF * 2**n
+POOL_SIZE = 4                # connections kept open (turn pool workers plus the dashboard)
+FAILURE_THRESHOLD = 5        # consecutive failures that open the breaker
+RESET_TIMEOUT = 30.0         # seconds the breaker stays open before letting one request try
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+RETRY_STATUSES = (502, 503, 504)
+
+class AIServerError(Exception):
+    pass
+
+class CircuitOpenError(AIServerError):
+    pass
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.times_opened = 0
+        self._lock = threading.Lock()
+
+    # closed: requests flow; open: they fail fast; half_open: one trial request is let through
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.time() - self.opened_at < self.reset_timeout:
+            return 'open'
+        return 'half_open'
+
+    def allow(self):
+        with self._lock:
+            state = self._state()
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            was_open = self.opened_at is not None
+            if was_open or self.failures >= self.failure_threshold:
+                if not was_open:
+                    self.times_opened += 1
+                    logging.warning(f"AI server failed {self.failures} times in a row, failing fast for {self.reset_timeout:.0f} s")
+                self.opened_at = time.time()  # a failed trial starts a new open period
+            self.trial_running = False
+
+class AIClient:
+    def __init__(self, url, stream_url=None, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT, retries=RETRIES,
+                 backoff=BACKOFF, breaker=None):
+        self.url = url
+        self.stream_url = stream_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.requests = 0
+        self.failures = 0
+        self.retried = 0
+        self.rejected = 0          # failed fast because the breaker was open
+        self.latency = RollingStats()
+        self.latency_ms = Histogram(LATENCY_BUCKETS_MS)
+        self.first_token = RollingStats()
+        self.first_token_ms = Histogram(LATENCY_BUCKETS_MS)
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    # POST json and return the decoded reply; raises AIServerError when the
+    # server can't be reached or keeps failing
+    def post(self, payload):
+        if not self.breaker.allow():
+            self._count('rejected')
+            raise CircuitOpenError("AI server is unavailable, try again shortly")
+        self._count('requests')
+        started = time.time()
+        try:
+            result = self._post_with_retries(payload)
+        except AIServerError:
+            self._count('failures')
+            self.breaker.failure()
+            raise
+        self.breaker.success()
+        elapsed = time.time() - started
+        self.latency.record(elapsed)
+        self.latency_ms.record(elapsed * 1000)
+        return result
+
+    # POST json to stream_url and yield the reply's tokens as they arrive.
+    # Stopping early (a cancelled turn) closes the connection and isn't a failure.
+    def stream(self, payload):
+        if not self.breaker.allow():
+            self._count('rejected')
+            raise CircuitOpenError("AI server is unavailable, try again shortly")
+        self._count('requests')
+        started = time.time()
+        failed = True
+        try:
+            response = self._post_with_retries(payload, url=self.stream_url, stream=True)
+            try:
+                first = True
+                done = False
+                for line in response.iter_lines(chunk_size=None):
+                    if not line:
+                        continue
+                    message = json.loads(line)
+                    if 'error' in message:
+                        raise AIServerError(message['error'])
+                    if message.get('done'):
+                        done = True
+                        break
+                    if first:
+                        first = False
+                        elapsed = time.time() - started
+                        self.first_token.record(elapsed)
+                        self.first_token_ms.record(elapsed * 1000)
+                    yield message['token']
+                if not done:
+                    # The server went away mid-reply; don't pass a truncated answer off as whole
+                    raise AIServerError("AI server reply ended early")
+                failed = False
+            except requests.RequestException as e:
+                raise AIServerError(f"Lost the AI server mid-reply: {e}")
+            except ValueError as e:
+                raise AIServerError(f"Bad reply from AI server: {e}")
+            finally:
+                response.close()
+        except GeneratorExit:
+            failed = False
+            raise
+        finally:
+            if failed:
+                self._count('failures')
+                self.breaker.failure()
+            else:
+                self.breaker.success()
+                elapsed = time.time() - started
+                self.latency.record(elapsed)
+                self.latency_ms.record(elapsed * 1000)
+
+    def _post_with_retries(self, payload, url=None, stream=False):
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self._count('retried')
+                time.sleep(random.uniform(0, self.backoff * 2 ** attempt))  # full jitter
+            try:
+                response = self.session.post(url or self.url, json=payload, timeout=self.timeout, stream=stream)
+            except (requests.ConnectionError, requests.exceptions.ConnectTimeout) as e:
+                error = AIServerError(f"Could not reach the AI server: {e}")
+                continue
+            except requests.Timeout:
+                # The request got there; sending it again would just queue another slow answer
+                raise AIServerError(f"AI server did not answer within {self.timeout[1]:.0f} s")
+            if response.status_code in RETRY_STATUSES:
+                error = AIServerError(f"AI server is busy ({response.status_code})")
+                continue
+            if response.status_code != 200:
+                raise AIServerError(f"Error from AI server: {response.text}")
+            return response if stream else response.json()
+        raise error
+
+    def stats(self):
+        return {
+            'url': self.url,
+            'breaker': self.breaker.state(),
+            'breaker_opened': self.breaker.times_opened,
+            'requests': self.requests,
+            'failures': self.failures,
+            'retries': self.retried,
+            'rejected': self.rejected,
+            'latency': self.latency.summary(),
+            'latency_ms': self.latency_ms.snapshot(),
+            'first_token': self.first_token.summary(),
+            'first_token_ms': self.first_token_ms.snapshot()
+        }
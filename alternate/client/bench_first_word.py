@@ -0,0 +1,64 @@
+# First-word latency of the AI server, streamed vs. whole replies
+#
+#   python bench_first_word.py [SERVER_URL] [-n 20]   (default: http://127.0.0.1:8000)
+#
+# Start the server with LLM_PROVIDERS=stub:0.05 to time it against the local
+# stub model instead of the network. For each request this measures when
+# the first token and the first whole word reach the client from
+# /process_ai_stream, next to how long /process_ai takes to return the full
+# reply, which is when the client used to be able to start.
+import sys
+import time
+import argparse
+from metrics import percentile
+from ai_client import AIClient
+
+# "latest" keeps the server's response caches out of the measurement
+PROMPT = "What's the latest on topic {}?"
+
+def time_stream(client, prompt):
+    started = time.perf_counter()
+    first_token = first_word = None
+    text = ''
+    for token in client.stream({'text': prompt}):
+        now = time.perf_counter()
+        if first_token is None:
+            first_token = now - started
+        text += token
+        if first_word is None and ' ' in text.strip():
+            first_word = now - started
+    total = time.perf_counter() - started
+    return first_token, first_word if first_word is not None else total, total
+
+def time_whole(client, prompt):
+    started = time.perf_counter()
+    client.post({'text': prompt})
+    return time.perf_counter() - started
+
+def report(name, seconds):
+    values = sorted(s * 1000 for s in seconds)
+    print(f"{name:<22} p50 {percentile(values, 50):8.1f} ms  p95 {percentile(values, 95):8.1f} ms  max {values[-1]:8.1f} ms")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('url', nargs='?', default='http://127.0.0.1:8000')
+    parser.add_argument('-n', type=int, default=20, help='requests per mode')
+    args = parser.parse_args()
+    url = args.url.rstrip('/')
+    client = AIClient(f'{url}/process_ai', f'{url}/process_ai_stream')
+
+    first_tokens, first_words, stream_totals, whole = [], [], [], []
+    for i in range(args.n):
+        first_token, first_word, total = time_stream(client, PROMPT.format(i))
+        first_tokens.append(first_token)
+        first_words.append(first_word)
+        stream_totals.append(total)
+        whole.append(time_whole(client, PROMPT.format(i)))
+
+    if None in first_tokens:
+        sys.exit("The server sent an empty reply")
+    print(f"{args.n} requests to {url}")
+    report('stream first token', first_tokens)
+    report('stream first word', first_words)
+    report('stream complete', stream_totals)
+    report('/process_ai reply', whole)
@@ -4,11 +4,17 @@ import speech_recognition as sr
 import os
 import psutil
 import subprocess
-import sqlite3
+import db
+from speech import SpeechPipeline, SpeechWorker
+from turns import TurnPool
+from audio_capture import AudioCapture
+from keyword_spotter import KeywordSpotter
+from recognizers import make_backend, listen_for_phrase
+from vad import Endpointer
+from stats_sampler import StatsSampler, DEFAULT_WINDOWS
 from flask import Flask, render_template, request, jsonify, Response
 from flask_cors import CORS
-import pyttsx3
-import requests  # Library to send HTTP requests to the AI server
+from ai_client import AIClient
 
 app = Flask(__name__)
 CORS(app)
@@ -17,46 +23,48 @@ assistant_active = False
 last_activation_time = 0
 kill_switch_activated = False
 current_speech = ""
-tts_lock = threading.Lock()
-stop_speech_event = threading.Event()  # New event to stop speech
+stats_sampler = StatsSampler()  # keeps /api/status from blocking on cpu_percent
+speech_worker = SpeechWorker(rate=150, volume=0.9)  # owns the TTS engine; interrupt() cuts speech
+turn_pool = TurnPool(on_supersede=speech_worker.interrupt)  # runs replies off the listen loop
+audio_capture = AudioCapture()  # keeps the microphone open and buffers what it hears
+wake_spotter = KeywordSpotter()  # keeps idle chatter away from recognize_google
+speech_backend = make_backend()  # SPEECH_BACKEND=google|vosk|whisper
+endpointer = Endpointer()  # decides where each phrase ends, sooner than Recognizer.listen did
 
 # Replace this with the IP address and port of your laptop running the AI server
 AI_SERVER_URL = 'http://192.168.180.253:8000/process_ai'
+AI_STREAM_URL = 'http://192.168.180.253:8000/process_ai_stream'
+ai_client = AIClient(AI_SERVER_URL, AI_STREAM_URL)  # keep-alive, timeouts, retries and a circuit breaker
+SPOKEN_ERROR_TEXT = "Sorry, something went wrong. Please try again."
 
 def init_db():
-    conn = sqlite3.connect('assistant.db')
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS settings (
-            id INTEGER PRIMARY KEY,
-            wake_word TEXT,
-            voice_enabled INTEGER,
-            assistant_personality TEXT,
-            stop_word TEXT
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS chat_history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user TEXT,
-            assistant TEXT
-        )
-    ''')
-    c.execute('SELECT COUNT(*) FROM settings')
-    if c.fetchone()[0] == 0:
+    with db.transaction() as conn:
+        c = conn.cursor()
         c.execute('''
-            INSERT INTO settings (id, wake_word, voice_enabled, assistant_personality, stop_word)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (1, 'hello', 1, 'Default', 'stop'))
-    conn.commit()
-    conn.close()
+            CREATE TABLE IF NOT EXISTS settings (
+                id INTEGER PRIMARY KEY,
+                wake_word TEXT,
+                voice_enabled INTEGER,
+                assistant_personality TEXT,
+                stop_word TEXT
+            )
+        ''')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS chat_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user TEXT,
+                assistant TEXT
+            )
+        ''')
+        c.execute('SELECT COUNT(*) FROM settings')
+        if c.fetchone()[0] == 0:
+            c.execute('''
+                INSERT INTO settings (id, wake_word, voice_enabled, assistant_personality, stop_word)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (1, 'hello', 1, 'Default', 'stop'))
 
 def get_settings():
-    conn = sqlite3.connect('assistant.db')
-    c = conn.cursor()
-    c.execute('SELECT wake_word, voice_enabled, assistant_personality, stop_word FROM settings WHERE id = 1')
-    result = c.fetchone()
-    conn.close()
+    result = db.fetchone('SELECT wake_word, voice_enabled, assistant_personality, stop_word FROM settings WHERE id = 1')
     if result:
         wake_word, voice_enabled, assistant_personality, stop_word = result
         return {
@@ -74,181 +82,167 @@ def get_settings():
         }
 
 def update_settings_in_db(wake_word, voice_enabled, assistant_personality, stop_word):
-    conn = sqlite3.connect('assistant.db')
-    c = conn.cursor()
-    c.execute('''
+    db.execute('''
         UPDATE settings
         SET wake_word = ?, voice_enabled = ?, assistant_personality = ?, stop_word = ?
         WHERE id = 1
     ''', (wake_word, int(voice_enabled), assistant_personality, stop_word))
-    conn.commit()
-    conn.close()
 
 def add_to_chat_history(user_text, assistant_response):
-    conn = sqlite3.connect('assistant.db')
-    c = conn.cursor()
-    c.execute('''
+    db.execute('''
         INSERT INTO chat_history (user, assistant)
         VALUES (?, ?)
     ''', (user_text, assistant_response))
-    conn.commit()
-    conn.close()
 
 def get_chat_history():
-    conn = sqlite3.connect('assistant.db')
-    c = conn.cursor()
-    c.execute('SELECT user, assistant FROM chat_history ORDER BY id')
-    rows = c.fetchall()
-    conn.close()
+    rows = db.fetchall('SELECT user, assistant FROM chat_history ORDER BY id')
     chat_history = [{'user': row[0], 'assistant': row[1]} for row in rows]
     return chat_history
 
-def get_system_stats():
-    cpu_usage = psutil.cpu_percent(interval=1)
-    memory = psutil.virtual_memory()
-    cpu_temp = 'Unavailable'
+def get_system_stats(windows=DEFAULT_WINDOWS):
+    stats_sampler.start()
+    stats = stats_sampler.snapshot(windows)
+    if stats['cpu_temp'] is None:
+        stats['cpu_temp'] = 'Unavailable'
+    return stats
+
+# Parse an optional ?windows=10,60 query argument into summary window sizes
+def parse_stats_windows():
+    windows = request.args.get('windows')
+    if not windows:
+        return DEFAULT_WINDOWS
+    return tuple(int(w) for w in windows.split(',') if w.strip())
+
+# Yield the reply as the AI server generates it. A failure (AIServerError,
+# or anything else) is raised after whatever tokens came first, so callers
+# must discard the partial reply rather than treat it as the answer.
+def ai_process_tokens(text):
+    settings = get_settings()
+    yield from ai_client.stream({
+        'text': text,
+        'assistant_personality': settings['assistant_personality']
+    })
 
-    try:
-        temp = psutil.sensors_temperatures()
-        for name in temp:
-            if 'cpu' in name.lower():
-                cpu_temp = temp[name][0].current
-                break
-    except (AttributeError, NotImplementedError):
-        cpu_temp = 'Unavailable'
-
-    return {
-        'cpu_usage': cpu_usage,
-        'memory_usage': memory.percent,
-        'cpu_temp': cpu_temp
-    }
-
-def ai_process(text):
-    try:
-        settings = get_settings()
-        assistant_personality = settings['assistant_personality']
-
-        # Send a request to the AI server
-        response = requests.post(AI_SERVER_URL, json={
-            'text': text,
-            'assistant_personality': assistant_personality
-        })
-
-        if response.status_code == 200:
-            ai_response = response.json().get('response', '')
-            return ai_response
-        else:
-            return f"Error from AI server: {response.text}"
-    except Exception as e:
-        return f"Error: {e}"
+# Frame a chunk as one server-sent event; multi-line text needs one data: line
+# per line. The page replaces the reply with an 'error' event's text.
+def format_sse_data(chunk, event=None):
+    head = f"event: {event}\n" if event else ''
+    return head + ''.join(f"data: {line}\n" for line in chunk.split('\n')) + "\n"
 
+# Forward tokens to the browser as they arrive and start speaking at the
+# first complete sentence, instead of waiting for the whole reply
 def ai_process_stream(text):
+    global current_speech
+    settings = get_settings()
+    speech = SpeechPipeline(speech_worker.say) if settings['voice_enabled'] else None
+    parts = []
     try:
-        settings = get_settings()
-        voice_enabled = settings['voice_enabled']
-        stop_word = settings['stop_word']
-
-        full_response = ai_process(text)
-
-        chunk_size = 50  
-        for i in range(0, len(full_response), chunk_size):
-            chunk = full_response[i:i+chunk_size]
-            yield f"data: {chunk}\n\n"
-            time.sleep(0.1)  
-
-        if voice_enabled:
-            with tts_lock:
-                # Reset the stop event
-                stop_speech_event.clear()
-                
-                local_tts_engine = pyttsx3.init()
-                local_tts_engine.setProperty('rate', 150)
-                local_tts_engine.setProperty('volume', 0.9)
-                
-                def on_word(name, location, length):
-                    if stop_speech_event.is_set():
-                        return False
-                    return True
-                
-                local_tts_engine.connect('started-word', on_word)
-                
-                try:
-                    local_tts_engine.say(full_response)
-                    local_tts_engine.runAndWait()
-                except Exception:
-                    pass  # Handle potential interruption
-
-        global current_speech
-        current_speech = f"Assistant: {full_response}"
-        add_to_chat_history(text, full_response)
-
+        for token in ai_process_tokens(text):
+            parts.append(token)
+            yield format_sse_data(token)
+            if speech is not None:
+                speech.feed(token)
+        full_response = ''.join(parts).strip()
     except Exception as e:
-        yield f"data: Error: {e}\n\n"
-
-def process_ai_response(text):
+        print(f"Error in ai_process_stream: {e}")
+        full_response = f"Error: {e}"
+        yield format_sse_data(full_response, event='error')
+        if speech is not None:
+            # Whatever was spoken of the reply stays cut off; the apology is always the same cached clip
+            speech.discard()
+            speech_worker.say(SPOKEN_ERROR_TEXT, cacheable=True)
+    if speech is not None:
+        speech.close()
+
+    current_speech = f"Assistant: {full_response}"
+    add_to_chat_history(text, full_response)
+
+# Runs on the turn pool; a newer turn cancels this one and cuts its speech
+def process_ai_response(text, turn=None):
     global current_speech
     settings = get_settings()
     voice_enabled = settings['voice_enabled']
-    stop_word = settings['stop_word']
 
-    ai_response = ai_process(text)
+    # Sentences are spoken as they complete; turn.ordered holds them back
+    # until earlier turns are done and drops them once this one is cancelled
+    say = speech_worker.say if turn is None else turn.ordered(speech_worker.say)
+    speech = SpeechPipeline(say) if voice_enabled else None
+    parts = []
+    try:
+        for token in ai_process_tokens(text):
+            if turn is not None and turn.is_cancelled():
+                break  # drops the connection to the AI server
+            parts.append(token)
+            if speech is not None:
+                speech.feed(token)
+        ai_response = ''.join(parts).strip()
+    except Exception as e:
+        print(f"Error in process_ai_response: {e}")
+        ai_response = f"Error: {e}"
+        if speech is not None:
+            speech.discard()
+            say(SPOKEN_ERROR_TEXT, cacheable=True)
+    # Publish results in turn order, and not at all for a superseded turn
+    if turn is not None and not turn.wait_for_delivery():
+        print(f"Turn superseded, dropping reply to: '{text}'")
+        return
+    if speech is not None:
+        speech.close()
     current_speech = f"Assistant: {ai_response}"
     add_to_chat_history(text, ai_response)
     print(f"AI Response: {ai_response}")
 
-    if voice_enabled:
-        with tts_lock:
-            # Reset the stop event
-            stop_speech_event.clear()
-            
-            local_tts_engine = pyttsx3.init()
-            local_tts_engine.setProperty('rate', 150)
-            local_tts_engine.setProperty('volume', 0.9)
-            
-            def on_word(name, location, length):
-                if stop_speech_event.is_set():
-                    return False
-                return True
-            
-            local_tts_engine.connect('started-word', on_word)
-            
-            try:
-                local_tts_engine.say(ai_response)
-                local_tts_engine.runAndWait()
-            except Exception:
-                pass  # Handle potential interruption
-
 def listen_loop():
     global assistant_active, last_activation_time, kill_switch_activated, current_speech
-    recognizer = sr.Recognizer()
-    microphone = sr.Microphone()
+    audio_capture.start()
+    # One reader for the whole loop, so no audio is skipped between phrases
+    buffered_source = audio_capture.source()
+
+    # Show what the user is saying while they say it (streaming backends only)
+    def show_partial(text):
+        global current_speech
+        if assistant_active:
+            current_speech = f"You said: {text}..."
 
     while not kill_switch_activated:
+        # A failed microphone closes the capture stream; reopen it instead of spinning on it
+        if not audio_capture.is_alive():
+            audio_capture.restart()
+            buffered_source = audio_capture.source()
+            continue
         settings = get_settings()
         wake_word = settings['wake_word']
         stop_word = settings['stop_word']
 
-        with microphone as source:
-            recognizer.adjust_for_ambient_noise(source)
+        with buffered_source as source:
             print("Listening...")
             try:
-                audio = recognizer.listen(source, timeout=5)
-                text = recognizer.recognize_google(audio)
-                print(f"Recognized: {text}")
+                chunks = endpointer.listen(source.stream, audio_capture.energy_threshold(), timeout=5)
+                phrase = listen_for_phrase(chunks, speech_backend, on_partial=show_partial)
+                # While idle, only phrases that sound like the wake word go to a cloud recognizer
+                samples = None
+                if not assistant_active:
+                    samples = phrase.samples
+                    if speech_backend.remote and not wake_spotter.might_match(samples, wake_word):
+                        continue
+                text = phrase.transcribe()
+                print(f"Recognized: {text} (endpoint after {endpointer.last_endpoint_delay * 1000:.0f} ms)")
 
                 # Check for stop word to halt speech
                 if text.lower() == stop_word.lower():
-                    stop_speech_event.set()
+                    turn_pool.cancel_all()
+                    speech_worker.interrupt()
                     current_speech = "Speech stopped."
                     continue
 
                 if not assistant_active and wake_word.lower() in text.lower():
+                    wake_spotter.enroll(samples, wake_word, text)
                     assistant_active = True
                     last_activation_time = time.time()
                     print("Wake word detected. Assistant activated.")
                 elif assistant_active:
                     current_speech = f"You said: {text}"
-                    threading.Thread(target=process_ai_response, args=(text,)).start()
+                    turn_pool.submit(process_ai_response, text)
 
                 if assistant_active and (time.time() - last_activation_time) > 120:
                     assistant_active = False
@@ -269,7 +263,11 @@ def index():
 
 @app.route('/api/status', methods=['GET'])
 def get_status():
-    stats = get_system_stats()
+    try:
+        windows = parse_stats_windows()
+    except ValueError:
+        return jsonify({'error': 'Invalid windows parameter'}), 400
+    stats = get_system_stats(windows)
     chat_history = get_chat_history()
     settings = get_settings()
     return jsonify({
@@ -277,7 +275,12 @@ def get_status():
         'assistant_active': assistant_active,
         'stats': stats,
         'chat_history': chat_history,
-        'settings': settings
+        'settings': settings,
+        'turns': turn_pool.stats(),
+        'audio': audio_capture.stats(),
+        'wake_word': wake_spotter.stats(),
+        'vad': endpointer.stats(),
+        'ai_server': ai_client.stats()
     })
 
 @app.route('/api/kill', methods=['POST'])
@@ -315,6 +318,10 @@ def start_server():
 if __name__ == '__main__':
     init_db()
 
+    stats_sampler.start()
+    speech_worker.start()
+    turn_pool.start()
+
     listen_thread = threading.Thread(target=listen_loop, daemon=True)
     listen_thread.start()
 
@@ -0,0 +1,171 @@
+# Bounded pool that runs voice turns (greetings and replies) off the listen loop
+#
+# Every recognized phrase used to get its own thread, so a noisy room could
+# pile up any number of concurrent LLM calls all writing the same globals
+# and talking over each other. Turns now go through a fixed set of workers
+# and a bounded queue. A new turn supersedes older ones by default: queued
+# turns are dropped and running ones are told to stop. Speech comes out in
+# submission order even when two turns run at once.
+import time
+import queue
+import logging
+import itertools
+import threading
+from metrics import RollingStats
+
+TURN_WORKERS = 2
+MAX_PENDING_TURNS = 8
+
+class Turn:
+    def __init__(self, pool, sequence, fn, args):
+        self.pool = pool
+        self.sequence = sequence
+        self.fn = fn
+        self.args = args
+        self.submitted_at = time.time()
+        self.cancelled = threading.Event()
+        self.done = threading.Event()
+
+    # Cancelled turns stop at their next check; wake anyone waiting on delivery order
+    def cancel(self):
+        self.cancelled.set()
+        with self.pool._condition:
+            self.pool._condition.notify_all()
+
+    def is_cancelled(self):
+        return self.cancelled.is_set()
+
+    # Block until no earlier turn is still live; False if this one was cancelled meanwhile
+    def wait_for_delivery(self, timeout=None):
+        return self.pool._wait_for_delivery(self, timeout)
+
+    # Wrap a speak() callable (e.g. SpeechWorker.say) so this turn's speech is
+    # queued only after earlier turns, and not at all once it is cancelled
+    def ordered(self, speak):
+        def ordered_speak(text, **kwargs):
+            if not self.wait_for_delivery():
+                return None
+            return speak(text, **kwargs)
+        return ordered_speak
+
+class TurnPool:
+    def __init__(self, workers=TURN_WORKERS, max_pending=MAX_PENDING_TURNS, on_supersede=None):
+        self.workers = workers
+        self.on_supersede = on_supersede  # called once when running turns are superseded, e.g. to cut speech
+        self.wait_time = RollingStats()    # seconds from submit() until a worker picks the turn up
+        self.run_time = RollingStats()
+        self.submitted = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.rejected = 0
+        self.running = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._sequence = itertools.count()
+        self._live = {}                    # sequence -> Turn, for turns queued or running
+        self._condition = threading.Condition()
+        self._threads = []
+
+    def start(self):
+        with self._condition:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'turn-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    # Queue fn(*args, turn=turn); returns the Turn, or None when the queue is full
+    def submit(self, fn, *args, supersede=True):
+        self.start()
+        interrupted = False
+        with self._condition:
+            turn = Turn(self, next(self._sequence), fn, args)
+            if supersede:
+                interrupted = self._supersede()
+            try:
+                self._queue.put_nowait(turn)
+            except queue.Full:
+                # Backpressure: keep the turns already waiting and refuse the new one
+                self.rejected += 1
+                self._finish(turn)
+                logging.warning(f"Turn queue full, dropping turn for {fn.__name__}")
+                return None
+            self._live[turn.sequence] = turn
+            self.submitted += 1
+        if interrupted and self.on_supersede is not None:
+            self.on_supersede()
+        return turn
+
+    # Drop queued turns and stop running ones, e.g. for a stop word or the kill switch
+    def cancel_all(self):
+        with self._condition:
+            self._supersede()
+
+    # Cancel every live turn; caller holds _condition. Returns True if one was running
+    def _supersede(self):
+        while True:
+            try:
+                queued = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            queued.cancel()
+            self.cancelled += 1
+            self._live.pop(queued.sequence, None)
+            self._finish(queued)
+        for running in self._live.values():
+            running.cancel()
+        return bool(self._live)
+
+    def _run(self):
+        while True:
+            turn = self._queue.get()
+            with self._condition:
+                self.running += 1
+            try:
+                if turn.is_cancelled():
+                    continue
+                started = time.time()
+                self.wait_time.record(started - turn.submitted_at)
+                turn.fn(*turn.args, turn=turn)
+                self.run_time.record(time.time() - started)
+            except Exception as e:
+                logging.error(f"Error in turn {turn.fn.__name__}: {e}")
+            finally:
+                with self._condition:
+                    self.running -= 1
+                    if turn.is_cancelled():
+                        self.cancelled += 1
+                    else:
+                        self.completed += 1
+                    self._live.pop(turn.sequence, None)
+                    self._finish(turn)
+
+    # Caller holds _condition
+    def _finish(self, turn):
+        turn.done.set()
+        self._condition.notify_all()
+
+    # A cancelled turn no longer holds up later ones; its speech is suppressed anyway
+    def _waiting_on_earlier(self, turn):
+        return any(sequence < turn.sequence and not t.is_cancelled() for sequence, t in self._live.items())
+
+    def _wait_for_delivery(self, turn, timeout):
+        with self._condition:
+            self._condition.wait_for(lambda: turn.is_cancelled() or not self._waiting_on_earlier(turn), timeout)
+            return not turn.is_cancelled() and not self._waiting_on_earlier(turn)
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        with self._condition:
+            return {
+                'pending': self._queue.qsize(),
+                'running': self.running,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'cancelled': self.cancelled,
+                'rejected': self.rejected,
+                'wait_time': self.wait_time.summary(),
+                'run_time': self.run_time.summary()
+            }
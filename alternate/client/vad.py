@@ -0,0 +1,146 @@
+# Voice activity detection and endpointing over captured audio
+#
+# Recognizer.listen() only ends a phrase after pause_threshold (0.8 s) of
+# silence, so every turn waited that long before recognition even started.
+# The Endpointer classifies 30 ms frames by energy against the noise floor,
+# several frames at a time in NumPy, and ends the phrase after a shorter,
+# tunable hangover. Bursts shorter than min_speech_ms (coughs, clicks, a
+# door) are dropped before they reach a recognizer.
+import numpy as np
+import speech_recognition as sr
+from metrics import RollingStats
+
+SAMPLE_RATE = 16000
+FRAME_MS = 30
+BLOCK_FRAMES = 4             # frames classified per NumPy call
+HANGOVER_MS = 400            # silence that ends a phrase
+MIN_SPEECH_MS = 250          # voiced audio a phrase needs to count
+ONSET_FRAMES = 2             # consecutive voiced frames that start a phrase
+PRE_ROLL_MS = 300            # audio kept from before the onset, so first syllables aren't clipped
+MAX_PHRASE_SECONDS = 15
+
+# One flag per whole frame: is its RMS above threshold
+def voiced_frames(samples, threshold, frame_len):
+    n = len(samples) // frame_len
+    frames = samples[:n * frame_len].reshape(n, frame_len).astype(np.float32)
+    return np.sqrt(np.mean(frames ** 2, axis=1)) > threshold
+
+class Endpointer:
+    def __init__(self, sample_rate=SAMPLE_RATE, frame_ms=FRAME_MS, hangover_ms=HANGOVER_MS,
+                 min_speech_ms=MIN_SPEECH_MS, onset_frames=ONSET_FRAMES, pre_roll_ms=PRE_ROLL_MS,
+                 max_phrase_seconds=MAX_PHRASE_SECONDS):
+        self.sample_rate = sample_rate
+        self.frame_len = sample_rate * frame_ms // 1000
+        self.frame_seconds = self.frame_len / sample_rate
+        self.hangover_frames = max(1, -(-hangover_ms // frame_ms))  # rounded up to whole frames
+        self.min_speech_frames = max(1, -(-min_speech_ms // frame_ms))
+        self.onset_frames = onset_frames
+        self.pre_roll_frames = pre_roll_ms // frame_ms
+        self.max_phrase_frames = int(max_phrase_seconds / self.frame_seconds)
+        self.endpoint_delay = RollingStats()  # seconds from the end of speech to the endpoint decision
+        self.speech_length = RollingStats()
+        self.phrases = 0
+        self.discarded = 0                    # bursts shorter than min_speech_ms
+        self.last_endpoint_delay = None
+        self.threshold = None
+        self._stream = None
+        self._frame_iter = None
+
+    # (samples, voiced) per frame; each read of BLOCK_FRAMES frames is classified in one go
+    def _frames(self, stream):
+        block = self.frame_len * BLOCK_FRAMES
+        while True:
+            data = stream.read(block)
+            samples = np.frombuffer(data, dtype=np.int16)
+            n = len(samples) // self.frame_len
+            if n == 0:
+                return
+            voiced = voiced_frames(samples, self.threshold, self.frame_len)
+            for i in range(n):
+                yield samples[i * self.frame_len:(i + 1) * self.frame_len], voiced[i]
+            if n < BLOCK_FRAMES:
+                return  # a short read means the stream has ended
+
+    # Yield the raw bytes of the next phrase on stream as it is spoken, like
+    # Recognizer.listen(stream=True). Raises sr.WaitTimeoutError if no phrase
+    # starts within timeout seconds of audio.
+    def listen(self, stream, threshold, timeout=None):
+        self.threshold = threshold
+        # Frames read ahead but not used by the last phrase carry over to the next one
+        if stream is not self._stream:
+            self._stream = stream
+            self._frame_iter = self._frames(stream)
+        frames = self._frame_iter
+        waited = 0.0
+        while True:
+            history = []
+            onset = 0
+            for samples, voiced in frames:
+                waited += self.frame_seconds
+                history.append(samples)
+                history = history[-(self.pre_roll_frames + self.onset_frames):]
+                onset = onset + 1 if voiced else 0
+                if onset >= self.onset_frames:
+                    break
+                if timeout and waited > timeout:
+                    raise sr.WaitTimeoutError("listening timed out while waiting for phrase to start")
+            else:
+                raise sr.WaitTimeoutError("audio stream ended before a phrase started")
+
+            spoken = False
+            for chunk in self._phrase(frames, stream, history, onset):
+                spoken = True
+                yield chunk
+            if spoken:
+                return
+            # Too short to be speech; keep waiting for a real phrase
+
+    # Frames of one phrase, held back until it has min_speech_frames of voice
+    # so short bursts never reach a recognizer
+    def _phrase(self, frames, stream, history, voiced_count):
+        pending = list(history)
+        committed = False
+        silence = 0
+        total = len(history)
+        for samples, voiced in frames:
+            total += 1
+            if voiced:
+                voiced_count += 1
+                silence = 0
+            else:
+                silence += 1
+            pending.append(samples)
+            if voiced_count >= self.min_speech_frames:
+                committed = True
+            if committed:
+                yield b''.join(chunk.tobytes() for chunk in pending)
+                pending = []
+            if silence >= self.hangover_frames or total >= self.max_phrase_frames:
+                break
+
+        if not committed:
+            self.discarded += 1
+            return
+        if pending:
+            yield b''.join(chunk.tobytes() for chunk in pending)
+        self._record(stream, silence, voiced_count)
+
+    def _record(self, stream, silence, voiced_count):
+        # Trailing silence that had to be heard, plus how far behind the live
+        # microphone the reader was when it decided (zero for files)
+        lag = stream.lag() if hasattr(stream, 'lag') else 0.0
+        delay = silence * self.frame_seconds + lag
+        self.last_endpoint_delay = delay
+        self.endpoint_delay.record(delay)
+        self.speech_length.record(voiced_count * self.frame_seconds)
+        self.phrases += 1
+
+    def stats(self):
+        return {
+            'phrases': self.phrases,
+            'discarded': self.discarded,
+            'hangover_ms': int(self.hangover_frames * self.frame_seconds * 1000),
+            'min_speech_ms': int(self.min_speech_frames * self.frame_seconds * 1000),
+            'endpoint_delay': self.endpoint_delay.summary(),
+            'speech_seconds': self.speech_length.summary()
+        }
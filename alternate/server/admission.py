@@ -0,0 +1,187 @@
+# Admission control for LLM calls on the AI server
+#
+# Every request used to call the LLM on its own werkzeug thread, so with
+# several Pis pointed at one laptop the calls all ran at once, slowed each
+# other down, and a chatty client could crowd out the rest. Requests now
+# wait for one of max_in_flight slots. Waiting requests are queued per
+# client and slots are handed out round-robin across clients, so one
+# client's backlog only delays that client. Identical prompts that arrive
+# while one is already queued or running share its token stream instead of
+# making their own call: the call runs on its own thread, and every request
+# for it replays the tokens so far and then follows along.
+import time
+import threading
+from collections import OrderedDict, deque
+from metrics import RollingStats, Histogram
+
+MAX_IN_FLIGHT = 4            # concurrent LLM calls
+MAX_QUEUED_PER_CLIENT = 8    # waiting requests per client before new ones are refused
+QUEUE_TIMEOUT = 30.0         # seconds a request may wait for a slot
+WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SERVICE_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class AdmissionError(Exception):
+    pass
+
+class _Ticket:
+    __slots__ = ('client', 'granted')
+
+    def __init__(self, client):
+        self.client = client
+        self.granted = False
+
+# Tokens of one LLM call, readable by any number of requests
+class _SharedStream:
+    def __init__(self):
+        self.chunks = []
+        self.finished = False
+        self.error = None
+        self._condition = threading.Condition()
+
+    def put(self, chunk):
+        with self._condition:
+            self.chunks.append(chunk)
+            self._condition.notify_all()
+
+    def finish(self, error=None):
+        with self._condition:
+            self.finished = True
+            self.error = error
+            self._condition.notify_all()
+
+    def read(self):
+        i = 0
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: i < len(self.chunks) or self.finished)
+                chunks = self.chunks[i:]
+                finished, error = self.finished, self.error
+            i += len(chunks)
+            yield from chunks
+            if finished and i == len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+
+class AdmissionQueue:
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT, max_queued_per_client=MAX_QUEUED_PER_CLIENT,
+                 queue_timeout=QUEUE_TIMEOUT):
+        self.max_in_flight = max_in_flight
+        self.max_queued_per_client = max_queued_per_client
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.admitted = 0
+        self.coalesced = 0
+        self.rejected = 0          # the client already had max_queued_per_client waiting
+        self.timed_out = 0
+        self.queue_wait = RollingStats()
+        self.queue_wait_seconds = Histogram(WAIT_BUCKETS)
+        self.service_time = RollingStats()
+        self.service_time_seconds = Histogram(SERVICE_BUCKETS)
+        self._queues = OrderedDict()  # client -> deque of tickets; the first client is served next
+        self._streams = {}            # coalescing key -> _SharedStream for prompts queued or running
+        self._condition = threading.Condition()
+
+    # Chunks of fn(*args), run in a slot on its own thread, or of the identical
+    # call (same key) already waiting or running. Raises AdmissionError when
+    # the client's queue is full or no slot frees up in time; a request that
+    # joined such a call gets the AdmissionError when it reads.
+    def stream(self, client, key, fn, *args):
+        with self._condition:
+            shared = self._streams.get(key)
+            leader = shared is None
+            if leader:
+                shared = self._streams[key] = _SharedStream()
+            else:
+                self.coalesced += 1
+        if leader:
+            try:
+                started = self.acquire(client)
+            except AdmissionError as e:
+                self._finish(key, shared, e)
+                raise
+            # Runs to the end even if every reader goes away, so the reply still gets cached
+            threading.Thread(target=self._produce, args=(key, shared, started, fn, args),
+                             name='llm-call', daemon=True).start()
+        return shared.read()
+
+    def _produce(self, key, shared, started, fn, args):
+        error = None
+        try:
+            for chunk in fn(*args):
+                shared.put(chunk)
+        except Exception as e:
+            error = e
+        finally:
+            self.release(started)
+            self._finish(key, shared, error)
+
+    def _finish(self, key, shared, error):
+        with self._condition:
+            del self._streams[key]
+        shared.finish(error)
+
+    # Wait for a slot; returns the time it was granted, to pass to release()
+    def acquire(self, client):
+        queued_at = time.time()
+        with self._condition:
+            queue = self._queues.get(client)
+            if queue is not None and len(queue) >= self.max_queued_per_client:
+                self.rejected += 1
+                raise AdmissionError(f"Too many requests waiting from {client}")
+            ticket = _Ticket(client)
+            self._queues.setdefault(client, deque()).append(ticket)
+            self._dispatch()
+            if not self._condition.wait_for(lambda: ticket.granted, self.queue_timeout):
+                queue = self._queues[client]
+                queue.remove(ticket)
+                if not queue:
+                    del self._queues[client]
+                self.timed_out += 1
+                raise AdmissionError(f"No LLM slot free after {self.queue_timeout:.0f} s")
+            self.admitted += 1
+        started = time.time()
+        self.queue_wait.record(started - queued_at)
+        self.queue_wait_seconds.record(started - queued_at)
+        return started
+
+    def release(self, started):
+        elapsed = time.time() - started
+        self.service_time.record(elapsed)
+        self.service_time_seconds.record(elapsed)
+        with self._condition:
+            self.in_flight -= 1
+            self._dispatch()
+
+    # Grant free slots round-robin across clients; caller holds _condition
+    def _dispatch(self):
+        granted = False
+        while self.in_flight < self.max_in_flight and self._queues:
+            client, queue = next(iter(self._queues.items()))
+            queue.popleft().granted = True
+            if queue:
+                self._queues.move_to_end(client)  # back of the line behind the other clients
+            else:
+                del self._queues[client]
+            self.in_flight += 1
+            granted = True
+        if granted:
+            self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            queued = {client: len(queue) for client, queue in self._queues.items()}
+            in_flight = self.in_flight
+        return {
+            'max_in_flight': self.max_in_flight,
+            'in_flight': in_flight,
+            'queued': queued,
+            'admitted': self.admitted,
+            'coalesced': self.coalesced,
+            'rejected': self.rejected,
+            'timed_out': self.timed_out,
+            'queue_wait': self.queue_wait.summary(),
+            'queue_wait_seconds': self.queue_wait_seconds.snapshot(),
+            'service_time': self.service_time.summary(),
+            'service_time_seconds': self.service_time_seconds.snapshot()
+        }
@@ -1,35 +1,79 @@
+import os
+import json
 import threading
 import time
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
-from g4f import ChatCompletion
+from werkzeug.serving import WSGIRequestHandler
 import asyncio
+from response_cache import ResponseCache, make_key, is_real_time
+from semantic_cache import SemanticCache
+from admission import AdmissionQueue, AdmissionError
+from llm import LLMRouter, make_providers
 asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
 app = Flask(__name__)
 CORS(app)
 
-def ai_process(text, assistant_personality):
-    try:
-        # Modify the assistant's behavior based on personality
-        personality_prefix = ""
-        if assistant_personality == "Friendly":
-            personality_prefix = "You are a friendly assistant. "
-        elif assistant_personality == "Professional":
-            personality_prefix = "You are a professional assistant. "
-
-        response = ChatCompletion.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "user", "content": personality_prefix + text}
-            ],
-            temperature=0.7,
-        )
-
-        message = response.strip()
-        return message
-    except Exception as e:
-        return f"Error: {e}"
+# No database on this machine, so the cache lives in memory only
+response_cache = ResponseCache()
+
+LLM_MODEL = "gpt-4o"
+# Providers the router picks from, e.g. "g4f:gpt-4o,g4f:gpt-4o@Blackbox"; LLM_PROVIDERS=stub:0.05
+# answers locally, one word per 50 ms, for measuring latency without the network (see llm.py)
+LLM_PROVIDERS = os.getenv('LLM_PROVIDERS', f'g4f:{LLM_MODEL}')
+llm = LLMRouter(make_providers(LLM_PROVIDERS, temperature=0.7))
+
+# Cosine similarity a new prompt needs with an earlier one to reuse its answer
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.9'))
+semantic_cache = SemanticCache(threshold=SEMANTIC_CACHE_THRESHOLD)
+
+# At most LLM_MAX_IN_FLIGHT model calls at once; the rest wait their turn, round-robin per client
+LLM_MAX_IN_FLIGHT = int(os.getenv('LLM_MAX_IN_FLIGHT', '4'))
+admission = AdmissionQueue(max_in_flight=LLM_MAX_IN_FLIGHT)
+
+# Yield the reply as the fastest provider generates it
+def stream_completion(messages):
+    yield from llm.stream(messages)
+
+# Repeated questions are answered from the cache instead of the LLM
+def cached_reply(text, assistant_personality):
+    if is_real_time(text):
+        return None
+    cached = response_cache.get(make_key(text, assistant_personality, LLM_MODEL))
+    if cached is not None:
+        return cached
+    # Then near-duplicates of earlier questions ("what's your name" / "what is your name")
+    return semantic_cache.lookup(text, assistant_personality, LLM_MODEL)
+
+# Yield a fresh reply from the LLM, caching it once it is complete
+def generate_reply(text, assistant_personality):
+    # Modify the assistant's behavior based on personality
+    personality_prefix = ""
+    if assistant_personality == "Friendly":
+        personality_prefix = "You are a friendly assistant. "
+    elif assistant_personality == "Professional":
+        personality_prefix = "You are a professional assistant. "
+
+    parts = []
+    for chunk in stream_completion([{"role": "user", "content": personality_prefix + text}]):
+        parts.append(chunk)
+        yield chunk
+    # Only reached when the stream finished; errors aren't cached
+    message = ''.join(parts).strip()
+    if not is_real_time(text):
+        response_cache.put(make_key(text, assistant_personality, LLM_MODEL), message)
+        semantic_cache.add(text, assistant_personality, LLM_MODEL, message)
+
+# Pis can name themselves with X-Client-Id; otherwise each address is one client
+def client_id():
+    return request.headers.get('X-Client-Id') or request.remote_addr
+
+# Chunks of the reply to a cache miss. Identical prompts already waiting or
+# running share that one LLM call; raises AdmissionError when the server is busy
+def reply_stream(text, assistant_personality):
+    key = make_key(text, assistant_personality, LLM_MODEL)
+    return admission.stream(client_id(), key, generate_reply, text, assistant_personality)
 
 @app.route('/process_ai', methods=['POST'])
 def process_ai():
@@ -39,9 +83,57 @@ def process_ai():
     if not text:
         return jsonify({'error': 'No text provided.'}), 400
 
-    ai_response = ai_process(text, assistant_personality)
+    ai_response = cached_reply(text, assistant_personality)
+    if ai_response is None:
+        try:
+            ai_response = ''.join(reply_stream(text, assistant_personality)).strip()
+        except AdmissionError as e:
+            return jsonify({'error': str(e)}), 503
+        except Exception as e:
+            ai_response = f"Error: {e}"
     return jsonify({'response': ai_response})
 
+# Same request as /process_ai, but the reply comes back as it is generated:
+# one JSON object per line, {"token": ...} for each chunk, then {"done": true},
+# or {"error": ...} if the model fails part way
+@app.route('/process_ai_stream', methods=['POST'])
+def process_ai_stream():
+    data = request.get_json()
+    text = data.get('text')
+    assistant_personality = data.get('assistant_personality', 'Default')
+    if not text:
+        return jsonify({'error': 'No text provided.'}), 400
+
+    cached = cached_reply(text, assistant_personality)
+    if cached is not None:
+        chunks = [cached]
+    else:
+        try:
+            chunks = reply_stream(text, assistant_personality)
+        except AdmissionError as e:
+            return jsonify({'error': str(e)}), 503
+
+    def generate():
+        try:
+            for chunk in chunks:
+                yield json.dumps({'token': chunk}) + '\n'
+            yield json.dumps({'done': True}) + '\n'
+        except Exception as e:
+            yield json.dumps({'error': f"Error: {e}"}) + '\n'
+    return Response(generate(), mimetype='application/x-ndjson')
+
+# Queue wait and service time of LLM calls, for watching several clients share the server
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return jsonify({
+        'admission': admission.stats(),
+        'llm': llm.stats(),
+        'response_cache': response_cache.stats(),
+        'semantic_cache': semantic_cache.stats()
+    })
+
 if __name__ == '__main__':
     # Run the AI server on your laptop's local network IP address and a chosen port (e.g., 8000), or on a VM
+    # HTTP/1.1 so the client's pooled connections stay open between turns (the dev server defaults to 1.0)
+    WSGIRequestHandler.protocol_version = 'HTTP/1.1'
     app.run(host='0.0.0.0', port=8000)
@@ -0,0 +1,65 @@
+# Small in-process metrics helpers for /api/status
+import bisect
+import threading
+from collections import deque
+
+class RollingStats:
+    # Keeps the most recent observations and summarises them on demand
+    def __init__(self, size=200):
+        self.values = deque(maxlen=size)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def record(self, value):
+        with self._lock:
+            self.values.append(value)
+            self.count += 1
+
+    def summary(self, digits=4):
+        with self._lock:
+            values = sorted(self.values)
+            count = self.count
+            last = self.values[-1] if self.values else None
+        if not values:
+            return {'count': count, 'last': None, 'avg': None, 'p50': None, 'p95': None, 'max': None}
+        return {
+            'count': count,
+            'last': round(last, digits),
+            'avg': round(sum(values) / len(values), digits),
+            'p50': round(percentile(values, 50), digits),
+            'p95': round(percentile(values, 95), digits),
+            'max': round(values[-1], digits)
+        }
+
+# Nearest-rank percentile of an already sorted list
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+# Counts of observations per bucket, cumulative like a Prometheus histogram
+# (each bucket counts everything at or below its bound)
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = tuple(sorted(bounds))
+        self.counts = [0] * (len(self.bounds) + 1)  # the last one is everything above the top bound
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, value):
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.total += value
+
+    def snapshot(self):
+        with self._lock:
+            counts = list(self.counts)
+            total = self.total
+        buckets = {}
+        running = 0
+        for bound, count in zip(self.bounds + (float('inf'),), counts):
+            running += count
+            buckets['+Inf' if bound == float('inf') else str(bound)] = running
+        return {'buckets': buckets, 'count': running, 'sum': round(total, 4)}
@@ -0,0 +1,134 @@
+# Pre-rendered speech for phrases the assistant repeats
+#
+# Audio is stored as WAV files named by a hash of (text, voice, rate, volume),
+# so a phrase rendered once plays straight from disk afterwards. Total size is
+# capped and the least recently played files are evicted first.
+import os
+import sys
+import hashlib
+import threading
+import subprocess
+from collections import OrderedDict
+
+CACHE_DIR = 'audio_cache'
+MAX_CACHE_BYTES = 50 * 1024 * 1024
+
+class AudioCache:
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> size in bytes, least recently used first
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def key(text, voice, rate, volume):
+        raw = f"{text}\x00{voice}\x00{rate}\x00{volume}"
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def path_for(self, key):
+        return os.path.join(self.directory, key + '.wav')
+
+    # Pick up files rendered by earlier runs, oldest access first
+    def _load(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.wav'):
+                continue
+            path = os.path.join(self.directory, name)
+            stat = os.stat(path)
+            files.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+
+    def get(self, key, count_miss=True):
+        with self._lock:
+            if key not in self._entries:
+                if count_miss:
+                    self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        path = self.path_for(key)
+        try:
+            os.utime(path)  # persist recency so the LRU order survives restarts
+        except OSError:
+            with self._lock:
+                self._entries.pop(key, None)
+            return None
+        return path
+
+    def contains(self, key):
+        with self._lock:
+            return key in self._entries
+
+    # Register a file that has just been rendered to path_for(key)
+    def add(self, key):
+        path = self.path_for(key)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        if size == 0:  # the engine failed to render anything
+            os.remove(path)
+            return
+        with self._lock:
+            self._entries[key] = size
+            self._entries.move_to_end(key)
+            evicted = self._evict()
+        for old_key in evicted:
+            try:
+                os.remove(self.path_for(old_key))
+            except OSError:
+                pass
+
+    def _evict(self):
+        evicted = []
+        total = sum(self._entries.values())
+        while total > self.max_bytes and len(self._entries) > 1:
+            old_key, size = self._entries.popitem(last=False)
+            total -= size
+            evicted.append(old_key)
+        return evicted
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': sum(self._entries.values()),
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+# Plays WAV files synchronously and can be stopped from another thread
+class WavPlayer:
+    def __init__(self):
+        self._process = None
+        self._lock = threading.Lock()
+
+    def play(self, path):
+        if sys.platform == 'win32':
+            import winsound
+            winsound.PlaySound(path, winsound.SND_FILENAME)
+            return
+        command = ['afplay', path] if sys.platform == 'darwin' else ['aplay', '-q', path]
+        process = subprocess.Popen(command)
+        with self._lock:
+            self._process = process
+        try:
+            process.wait()
+        finally:
+            with self._lock:
+                self._process = None
+
+    def stop(self):
+        if sys.platform == 'win32':
+            import winsound
+            winsound.PlaySound(None, 0)  # stops whatever PlaySound is playing
+            return
+        with self._lock:
+            if self._process is not None:
+                self._process.terminate()
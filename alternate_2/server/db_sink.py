@@ -0,0 +1,98 @@
+# Asynchronous, batched writes to SQLite
+#
+# /api/pi_data used to insert each sample inside the request and the presence
+# detector found it again by polling the table. Samples now travel over the
+# event bus; the table is only a record, so writes are queued here and a
+# background thread commits whatever has accumulated in one executemany.
+import time
+import queue
+import logging
+import threading
+import db
+from metrics import RollingStats
+
+QUEUE_SIZE = 10000       # puts held while the database is slow; newer ones are dropped past this
+BATCH_SIZE = 500         # rows per transaction, unless a single put_many brings more
+FLUSH_INTERVAL = 0.5     # seconds to wait for more rows after the first one arrives
+
+class DbSink:
+    def __init__(self, sql, name='db-sink', queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.sql = sql
+        self.name = name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batch_rows = RollingStats()
+        self.write_latency = RollingStats()  # seconds per transaction
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._stop_event.clear()
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    # Write whatever is queued, then stop
+    def stop(self, timeout=5):
+        self._stop_event.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    # Queue one row of parameters for sql; never blocks the caller
+    def put(self, params):
+        return self.put_many([params])
+
+    # Queue rows that should land in the same transaction
+    def put_many(self, rows):
+        try:
+            self._queue.put_nowait(rows)
+            return True
+        except queue.Full:
+            self.dropped += len(rows)
+            return False
+
+    def pending(self):
+        return self._queue.qsize()  # puts, not rows
+
+    def _run(self):
+        while not (self._stop_event.is_set() and self._queue.empty()):
+            try:
+                rows = list(self._queue.get(timeout=self.flush_interval))
+            except queue.Empty:
+                continue
+            deadline = time.time() + self.flush_interval
+            while len(rows) < self.batch_size:
+                try:
+                    rows.extend(self._queue.get(timeout=max(0, deadline - time.time())))
+                except queue.Empty:
+                    break
+            self._write(rows)
+
+    def _write(self, rows):
+        started = time.time()
+        try:
+            db.executemany(self.sql, rows)
+        except Exception as e:
+            self.failed += len(rows)
+            logging.error(f"{self.name}: failed to write {len(rows)} rows: {e}")
+            return
+        self.write_latency.record(time.time() - started)
+        self.batch_rows.record(len(rows))
+        self.written += len(rows)
+
+    def stats(self):
+        return {
+            'written': self.written,
+            'pending': self.pending(),
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'batch_rows': self.batch_rows.summary(1),
+            'write_latency': self.write_latency.summary()
+        }
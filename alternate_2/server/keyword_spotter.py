@@ -0,0 +1,204 @@
+# Offline wake-word spotting in front of the cloud recognizer
+#
+# While the assistant is idle, every phrase used to go to recognize_google
+# just to check whether it contained the wake word. The spotter compares the
+# phrase against recorded examples of the wake word (MFCC features matched
+# with subsequence DTW, both in NumPy) and only lets likely matches through.
+#
+# Examples live in wake_words/<wake word>/*.wav. Any phrase the cloud
+# recognizer confirms as containing the wake word is saved there too, so the
+# spotter trains itself; until it has MIN_TEMPLATES examples it lets
+# everything through and behaves exactly like before.
+import os
+import re
+import time
+import wave
+import logging
+import threading
+import numpy as np
+from metrics import RollingStats
+
+SAMPLE_RATE = 16000
+FRAME_MS = 25
+HOP_MS = 10
+N_FFT = 512
+N_MELS = 26
+N_MFCC = 13
+PRE_EMPHASIS = 0.97
+
+TEMPLATE_DIR = 'wake_words'
+MIN_TEMPLATES = 3            # gate stays open until this many examples exist
+MAX_TEMPLATES = 10           # self-enrollment stops here
+THRESHOLD_MARGIN = 1.25      # auto threshold: worst leave-one-out example score times this
+
+def _mel(hz):
+    return 2595.0 * np.log10(1.0 + hz / 700.0)
+
+def _hz(mel):
+    return 700.0 * (10 ** (mel / 2595.0) - 1.0)
+
+def mel_filterbank(sample_rate=SAMPLE_RATE, n_fft=N_FFT, n_mels=N_MELS):
+    edges = _hz(np.linspace(_mel(0), _mel(sample_rate / 2), n_mels + 2))
+    bins = np.floor((n_fft + 1) * edges / sample_rate).astype(int)
+    bank = np.zeros((n_mels, n_fft // 2 + 1), dtype=np.float32)
+    for m in range(1, n_mels + 1):
+        left, centre, right = bins[m - 1], bins[m], bins[m + 1]
+        if centre > left:
+            bank[m - 1, left:centre] = (np.arange(left, centre) - left) / (centre - left)
+        if right > centre:
+            bank[m - 1, centre:right] = (right - np.arange(centre, right)) / (right - centre)
+    return bank
+
+def dct_matrix(n_in=N_MELS, n_out=N_MFCC):
+    k = np.arange(n_out)[:, None]
+    n = np.arange(n_in)[None, :]
+    return (np.cos(np.pi * k * (2 * n + 1) / (2 * n_in)) * np.sqrt(2.0 / n_in)).astype(np.float32)
+
+MEL_BANK = mel_filterbank()
+DCT = dct_matrix()
+
+# (frames, N_MFCC) features with per-utterance mean and variance normalization
+def mfcc(samples, sample_rate=SAMPLE_RATE):
+    signal = np.asarray(samples, dtype=np.float32)
+    signal = np.append(signal[:1], signal[1:] - PRE_EMPHASIS * signal[:-1])
+    frame_len = sample_rate * FRAME_MS // 1000
+    hop = sample_rate * HOP_MS // 1000
+    if len(signal) < frame_len:
+        signal = np.pad(signal, (0, frame_len - len(signal)))
+    n_frames = 1 + (len(signal) - frame_len) // hop
+    indices = np.arange(frame_len)[None, :] + hop * np.arange(n_frames)[:, None]
+    frames = signal[indices] * np.hamming(frame_len).astype(np.float32)
+    power = np.abs(np.fft.rfft(frames, N_FFT)) ** 2 / N_FFT
+    energies = np.log(power @ MEL_BANK.T + 1e-10)
+    features = energies @ DCT.T
+    features -= features.mean(axis=0)
+    features /= features.std(axis=0) + 1e-8
+    return features
+
+# Cost of the best match of template anywhere inside utterance, per template frame.
+# Rows are solved one at a time; within a row the left-to-right dependency
+# is a running minimum, so each row is a handful of vector operations.
+def subsequence_dtw(template, utterance):
+    t2 = np.sum(template ** 2, axis=1)[:, None]
+    u2 = np.sum(utterance ** 2, axis=1)[None, :]
+    distances = np.sqrt(np.maximum(t2 + u2 - 2 * template @ utterance.T, 0)) / np.sqrt(template.shape[1])
+    previous = np.zeros(utterance.shape[0])  # free start anywhere in the utterance
+    for row in distances:
+        diagonal = np.concatenate(([np.inf], previous[:-1]))
+        best_above = np.minimum(previous, diagonal)
+        totals = np.cumsum(row)
+        shifted = np.concatenate(([0.0], totals[:-1]))
+        previous = totals + np.minimum.accumulate(best_above - shifted)
+    return float(previous.min()) / len(template)  # free end as well
+
+def read_wav(path):
+    with wave.open(path, 'rb') as f:
+        if f.getsampwidth() != 2 or f.getnchannels() != 1 or f.getframerate() != SAMPLE_RATE:
+            raise ValueError(f"{path}: expected 16-bit mono {SAMPLE_RATE} Hz")
+        return np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16)
+
+def write_wav(path, samples):
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(np.asarray(samples, dtype=np.int16).tobytes())
+
+def normalize_words(text):
+    return ' '.join(re.findall(r"[a-z0-9']+", text.lower()))
+
+class KeywordSpotter:
+    # threshold=None derives it from how well the examples match each other
+    def __init__(self, directory=TEMPLATE_DIR, threshold=None):
+        self.directory = directory
+        self.fixed_threshold = threshold
+        self.threshold = threshold
+        self.wake_word = None
+        self.templates = []
+        self.checked = 0
+        self.passed = 0
+        self.last_score = None
+        self.latency = RollingStats()
+        self._lock = threading.Lock()
+
+    def _word_dir(self, wake_word):
+        slug = re.sub(r'[^a-z0-9]+', '_', wake_word.lower()).strip('_') or 'wake_word'
+        return os.path.join(self.directory, slug)
+
+    # Load the examples for wake_word if it changed since the last call
+    def configure(self, wake_word):
+        with self._lock:
+            if wake_word == self.wake_word:
+                return
+            self.wake_word = wake_word
+            self.templates = []
+            self.threshold = self.fixed_threshold
+            word_dir = self._word_dir(wake_word)
+            if os.path.isdir(word_dir):
+                for name in sorted(os.listdir(word_dir)):
+                    if name.endswith('.wav'):
+                        try:
+                            self.templates.append(mfcc(read_wav(os.path.join(word_dir, name))))
+                        except (ValueError, wave.Error) as e:
+                            logging.warning(f"Skipping wake word example {name}: {e}")
+            self._calibrate()
+            logging.info(f"Keyword spotter: {len(self.templates)} examples for '{wake_word}'")
+
+    # Caller holds _lock
+    def _calibrate(self):
+        if self.fixed_threshold is not None or len(self.templates) < 2:
+            return
+        worst = 0.0
+        for i, template in enumerate(self.templates):
+            others = self.templates[:i] + self.templates[i + 1:]
+            worst = max(worst, min(subsequence_dtw(other, template) for other in others))
+        self.threshold = worst * THRESHOLD_MARGIN
+
+    def ready(self):
+        return len(self.templates) >= MIN_TEMPLATES
+
+    def score(self, samples):
+        features = mfcc(samples)
+        return min(subsequence_dtw(template, features) for template in self.templates)
+
+    # True if the phrase may contain the wake word and is worth sending to the cloud recognizer
+    def might_match(self, samples, wake_word):
+        self.configure(wake_word)
+        if not self.ready():
+            return True
+        started = time.time()
+        score = self.score(samples)
+        self.latency.record(time.time() - started)
+        self.checked += 1
+        self.last_score = score
+        if self.threshold is None or score <= self.threshold:
+            self.passed += 1
+            return True
+        return False
+
+    # Save a phrase the cloud recognizer heard as just the wake word as a new example
+    def enroll(self, samples, wake_word, transcript):
+        if normalize_words(transcript) != normalize_words(wake_word):
+            return  # extra words around the wake word would make a poor template
+        self.configure(wake_word)
+        with self._lock:
+            if len(self.templates) >= MAX_TEMPLATES:
+                return
+            word_dir = self._word_dir(wake_word)
+            os.makedirs(word_dir, exist_ok=True)
+            write_wav(os.path.join(word_dir, f'{int(time.time() * 1000)}.wav'), samples)
+            self.templates.append(mfcc(samples))
+            self._calibrate()
+
+    def stats(self):
+        return {
+            'wake_word': self.wake_word,
+            'examples': len(self.templates),
+            'active': self.ready(),
+            'threshold': None if self.threshold is None else round(self.threshold, 3),
+            'checked': self.checked,
+            'passed': self.passed,
+            'skipped': self.checked - self.passed,
+            'last_score': None if self.last_score is None else round(self.last_score, 3),
+            'latency': self.latency.summary()
+        }
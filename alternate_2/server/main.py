@@ -2,15 +2,30 @@ import threading
 import time
 import speech_recognition as sr
 import os
-import psutil
-import sqlite3
+import db
+import queue
+from events import EventBus, format_sse
+from metrics import RollingStats
+from speech import SpeechPipeline, SpeechWorker, PRIORITY_HIGH
+from audio_cache import AudioCache
+from response_cache import ResponseCache, make_key, is_real_time
+from semantic_cache import SemanticCache
+from turns import TurnPool
+from audio_capture import AudioCapture
+from keyword_spotter import KeywordSpotter
+from recognizers import make_backend, listen_for_phrase
+from vad import Endpointer
+from stats_sampler import StatsSampler, DEFAULT_WINDOWS
+from db_sink import DbSink
+import pi_ingest
+from telemetry import TelemetryStore, parse_time_arg, SCHEMA as TELEMETRY_SCHEMA
+from pi_window import TelemetryWindow
+from conversation import ConversationContext
+from llm import LLMRouter, make_providers
 from flask import Flask, render_template, request, jsonify, Response
 from flask_cors import CORS
-from g4f import ChatCompletion
-import pyttsx3
 import asyncio
 import logging
-import requests
 from datetime import datetime
 from dotenv import load_dotenv
 
@@ -26,62 +41,121 @@ assistant_active = False
 last_activation_time = 0
 kill_switch_activated = False
 current_speech = ""
-tts_lock = threading.Lock()
+audio_cache = AudioCache()  # pre-rendered WAVs for CACHED_PHRASES
+speech_worker = SpeechWorker(rate=150, volume=0.9, audio_cache=audio_cache)  # owns the only TTS engine
+event_bus = EventBus()  # fans state changes out to /api/events subscribers
+turn_pool = TurnPool(on_supersede=speech_worker.interrupt)  # runs greetings and replies off the listen loop
+audio_capture = AudioCapture()  # keeps the microphone open and buffers what it hears
+wake_spotter = KeywordSpotter()  # keeps idle chatter away from recognize_google
+speech_backend = make_backend()  # SPEECH_BACKEND=google|vosk|whisper
+endpointer = Endpointer()  # decides where each phrase ends, sooner than Recognizer.listen did
+llm_ttft = RollingStats()            # seconds from request to first streamed token
+llm_tokens_per_sec = RollingStats()  # streamed chunks per second after the first one
+response_cache = ResponseCache(store=db)  # repeated prompts skip the LLM
+telemetry = TelemetryStore(store=db)  # Pi telemetry rollups behind /api/pi_history
+pi_window = TelemetryWindow()  # recent Pi samples for /api/status and /api/pi_latest_data
+pi_data_sink = DbSink('''
+    INSERT INTO pi_data (timestamp, cpu_usage, memory_usage, cpu_temp, sensor_distance)
+    VALUES (?, ?, ?, ?, ?)
+''', name='pi-data-sink')  # /api/pi_data answers before the row is written
+stats_sampler = StatsSampler(on_sample=lambda sample: event_bus.publish('stats', sample))
+
+# Phrases spoken often enough to pre-render; they play from the audio cache
+GREETING_TEXT = "Hello! How can I assist you today?"
+SPOKEN_ERROR_TEXT = "Sorry, something went wrong. Please try again."
+CACHED_PHRASES = [GREETING_TEXT, SPOKEN_ERROR_TEXT]
+
+LLM_MODEL = "gpt-4"
+# Providers the router picks from, e.g. "g4f:gpt-4o,g4f:gpt-4o@Blackbox" or "stub:0.05"; see llm.py
+LLM_PROVIDERS = os.getenv('LLM_PROVIDERS', f'g4f:{LLM_MODEL}')
+llm = LLMRouter(make_providers(LLM_PROVIDERS))
+# Conversation sessions: the voice loop is one, the dashboard's text box another
+VOICE_SESSION = 'voice'
+DASHBOARD_SESSION = 'dashboard'
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '1024'))
+PI_RECENT_SECONDS = 60  # span of the rolling Pi stats in /api/status
+# Cosine similarity a new prompt needs with an earlier one to reuse its answer
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.9'))
+semantic_cache = SemanticCache(threshold=SEMANTIC_CACHE_THRESHOLD)
+
+# In-memory settings snapshot, loaded once and replaced on every update
+settings_lock = threading.Lock()
+settings_cache = None
+settings_version = 0
+
+# Update shared state and notify dashboards in one place
+def set_current_speech(text):
+    global current_speech
+    current_speech = text
+    event_bus.publish('speech', {'current_speech': text})
+
+def set_assistant_active(active):
+    global assistant_active
+    if assistant_active != active:
+        assistant_active = active
+        if not active:
+            conversation.reset(VOICE_SESSION)  # the next person to walk up starts a new conversation
+        event_bus.publish('assistant_active', {'assistant_active': active})
 
 def init_db():
-    conn = sqlite3.connect('assistant.db')
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS settings (
-            id INTEGER PRIMARY KEY,
-            wake_word TEXT,
-            voice_enabled INTEGER,
-            assistant_personality TEXT,
-            sensor_enabled INTEGER DEFAULT 1
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS chat_history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user TEXT,
-            assistant TEXT
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS requests (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT,
-            user_text TEXT,
-            assistant_response TEXT
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS pi_data (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT,
-            cpu_usage REAL,
-            memory_usage REAL,
-            cpu_temp REAL,
-            sensor_distance REAL
-        )
-    ''')
-    c.execute('SELECT COUNT(*) FROM settings')
-    if c.fetchone()[0] == 0:
+    with db.transaction() as conn:
+        c = conn.cursor()
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS settings (
+                id INTEGER PRIMARY KEY,
+                wake_word TEXT,
+                voice_enabled INTEGER,
+                assistant_personality TEXT,
+                sensor_enabled INTEGER DEFAULT 1
+            )
+        ''')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS chat_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user TEXT,
+                assistant TEXT
+            )
+        ''')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS requests (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TEXT,
+                user_text TEXT,
+                assistant_response TEXT
+            )
+        ''')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS pi_data (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TEXT,
+                cpu_usage REAL,
+                memory_usage REAL,
+                cpu_temp REAL,
+                sensor_distance REAL
+            )
+        ''')
+        # Rollup tiers and the timestamp index, see telemetry.py
+        for statement in TELEMETRY_SCHEMA:
+            c.execute(statement)
+        # Cached LLM replies, see response_cache.py
         c.execute('''
-            INSERT INTO settings (id, wake_word, voice_enabled, assistant_personality, sensor_enabled)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (1, 'hello', 1, 'Default', 1))
-    conn.commit()
-    conn.close()
+            CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        ''')
+        c.execute('SELECT COUNT(*) FROM settings')
+        if c.fetchone()[0] == 0:
+            c.execute('''
+                INSERT INTO settings (id, wake_word, voice_enabled, assistant_personality, sensor_enabled)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (1, 'hello', 1, 'Default', 1))
 
 init_db()
 
-def get_settings():
-    conn = sqlite3.connect('assistant.db')
-    c = conn.cursor()
-    c.execute('SELECT wake_word, voice_enabled, assistant_personality, sensor_enabled FROM settings WHERE id = 1')
-    result = c.fetchone()
-    conn.close()
+def load_settings_from_db():
+    result = db.fetchone('SELECT wake_word, voice_enabled, assistant_personality, sensor_enabled FROM settings WHERE id = 1')
     if result:
         wake_word, voice_enabled, assistant_personality, sensor_enabled = result
         return {
@@ -98,179 +172,286 @@ def get_settings():
             'sensor_enabled': True
         }
 
+def get_settings():
+    global settings_cache
+    cached = settings_cache
+    if cached is None:
+        with settings_lock:
+            if settings_cache is None:
+                settings_cache = load_settings_from_db()
+            cached = settings_cache
+    # Hand out a copy so callers can't mutate the published snapshot
+    return dict(cached)
+
+def get_settings_version():
+    return settings_version
+
 def update_settings_in_db(wake_word, voice_enabled, assistant_personality, sensor_enabled):
-    conn = sqlite3.connect('assistant.db')
-    c = conn.cursor()
-    c.execute('''
-        UPDATE settings
-        SET wake_word = ?, voice_enabled = ?, assistant_personality = ?, sensor_enabled = ?
-        WHERE id = 1
-    ''', (wake_word, int(voice_enabled), assistant_personality, int(sensor_enabled)))
-    conn.commit()
-    conn.close()
+    global settings_cache, settings_version
+    # Hold the lock across the write so the cache and the table never disagree
+    with settings_lock:
+        db.execute('''
+            UPDATE settings
+            SET wake_word = ?, voice_enabled = ?, assistant_personality = ?, sensor_enabled = ?
+            WHERE id = 1
+        ''', (wake_word, int(voice_enabled), assistant_personality, int(sensor_enabled)))
+        settings_cache = {
+            'wake_word': wake_word,
+            'voice_enabled': bool(voice_enabled),
+            'assistant_personality': assistant_personality,
+            'sensor_enabled': bool(sensor_enabled)
+        }
+        settings_version += 1
+        event_bus.publish('settings', {'version': settings_version, 'settings': dict(settings_cache)})
 
 def log_request(user_text, assistant_response):
-    conn = sqlite3.connect('assistant.db')
-    c = conn.cursor()
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    c.execute('''
+    db.execute('''
         INSERT INTO requests (timestamp, user_text, assistant_response)
         VALUES (?, ?, ?)
     ''', (timestamp, user_text, assistant_response))
-    conn.commit()
-    conn.close()
+    event_bus.publish('request', {'timestamp': timestamp, 'user_text': user_text, 'assistant_response': assistant_response})
 
 def add_to_chat_history(user_text, assistant_response):
-    conn = sqlite3.connect('assistant.db')
-    c = conn.cursor()
-    c.execute('''
+    db.execute('''
         INSERT INTO chat_history (user, assistant)
         VALUES (?, ?)
     ''', (user_text, assistant_response))
-    conn.commit()
-    conn.close()
+    event_bus.publish('chat', {'user': user_text, 'assistant': assistant_response})
 
 def get_chat_history():
-    conn = sqlite3.connect('assistant.db')
-    c = conn.cursor()
-    c.execute('SELECT user, assistant FROM chat_history ORDER BY id DESC LIMIT 100')
-    rows = c.fetchall()
-    conn.close()
+    rows = db.fetchall('SELECT user, assistant FROM chat_history ORDER BY id DESC LIMIT 100')
     chat_history = [{'user': row[0], 'assistant': row[1]} for row in rows]
     return chat_history
 
-def get_system_stats():
-    cpu_usage = psutil.cpu_percent(interval=1)
-    memory = psutil.virtual_memory()
-    cpu_temp = None
-
-    try:
-        temp = psutil.sensors_temperatures()
-        for name in temp:
-            if 'cpu' in name.lower():
-                cpu_temp = temp[name][0].current
-                break
-    except (AttributeError, NotImplementedError):
-        cpu_temp = None
-
-    return {
-        'cpu_usage': cpu_usage,
-        'memory_usage': memory.percent,
-        'cpu_temp': cpu_temp
-    }
-
-def ai_process(text):
+# Seed the telemetry window with the newest stored samples after a restart
+def load_pi_window():
+    rows = db.fetchall('''
+        SELECT timestamp, cpu_usage, memory_usage, cpu_temp, sensor_distance
+        FROM pi_data
+        ORDER BY id DESC
+        LIMIT ?
+    ''', (pi_window.capacity,))
+    pi_window.add([dict(zip(pi_ingest.FIELDS, row)) for row in reversed(rows)])
+
+def get_system_stats(windows=DEFAULT_WINDOWS):
+    stats_sampler.start()
+    stats = stats_sampler.snapshot(windows)
+    return stats
+
+# Parse an optional ?windows=10,60 query argument into summary window sizes
+def parse_stats_windows():
+    windows = request.args.get('windows')
+    if not windows:
+        return DEFAULT_WINDOWS
+    return tuple(int(w) for w in windows.split(',') if w.strip())
+
+# Yield the assistant's reply as it is generated, and add the exchange to the
+# session's conversation context once it is complete
+def ai_process_tokens(text, session=VOICE_SESSION):
+    parts = []
+    for chunk in reply_tokens(text, session):
+        parts.append(chunk)
+        yield chunk
+    conversation.add(session, text, ''.join(parts).strip())
+
+def reply_tokens(text, session):
+    settings = get_settings()
+    assistant_personality = settings['assistant_personality']
+
+    personality_prefix = ""
+    if assistant_personality == "Friendly":
+        personality_prefix = "You are a friendly assistant. "
+    elif assistant_personality == "Professional":
+        personality_prefix = "You are a professional assistant. "
+
+    if "what's the time" in text.lower() or "what is the time" in text.lower():
+        current_time = datetime.now().strftime('%I:%M %p')
+        yield f"The current time is {current_time}."
+        return
+
+    messages = conversation.messages(session, personality_prefix + "You are an AI assistant.", text)
+
+    # Questions about the weather, news etc. always go to the model, and so do
+    # follow-ups, which depend on the turns before them
+    if is_real_time(text) or len(messages) > 2:
+        yield from stream_completion(messages)
+        return
+
+    # Repeated questions are answered from the cache instead of the LLM
+    cache_key = make_key(text, assistant_personality, LLM_MODEL)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        yield cached
+        return
+    # Then near-duplicates of earlier questions ("what's your name" / "what is your name")
+    cached = semantic_cache.lookup(text, assistant_personality, LLM_MODEL)
+    if cached is not None:
+        yield cached
+        return
+
+    # Otherwise ask the LLM
+    parts = []
+    for chunk in stream_completion(messages):
+        parts.append(chunk)
+        yield chunk
+    # Only reached when the stream finished; errors and abandoned streams aren't cached
+    response = ''.join(parts).strip()
+    response_cache.put(cache_key, response)
+    semantic_cache.add(text, assistant_personality, LLM_MODEL, response)
+
+# Stream a chat completion from the fastest provider, recording time-to-first-token and throughput
+def stream_completion(messages):
+    started = time.time()
+    first_token_at = None
+    token_count = 0
+    for chunk in llm.stream(messages):
+        if first_token_at is None:
+            first_token_at = time.time()
+            llm_ttft.record(first_token_at - started)
+        token_count += 1
+        yield chunk
+
+    if first_token_at is not None:
+        generation_time = time.time() - first_token_at
+        if generation_time > 0:
+            llm_tokens_per_sec.record(token_count / generation_time)
+
+# Fold turns that no longer fit the context budget into the running summary;
+# runs on the conversation summarizer thread. Not through stream_completion,
+# so its long prompts stay out of the user-facing latency metrics.
+def summarize_conversation(previous_summary, turns):
+    transcript = '\n'.join(f"User: {turn.user}\nAssistant: {turn.assistant}" for turn in turns)
+    if previous_summary:
+        transcript = f"Summary so far: {previous_summary}\n{transcript}"
+    return ''.join(llm.stream([
+        {"role": "system", "content": "Summarize this conversation in at most three sentences. Keep names, facts and "
+                                      "anything the user may refer back to."},
+        {"role": "user", "content": transcript}
+    ], background=True))
+
+conversation = ConversationContext(summarize=summarize_conversation, token_budget=CONTEXT_TOKEN_BUDGET)
+
+def ai_process(text, session=VOICE_SESSION):
     try:
-        settings = get_settings()
-        assistant_personality = settings['assistant_personality']
-
-        personality_prefix = ""
-        if assistant_personality == "Friendly":
-            personality_prefix = "You are a friendly assistant. "
-        elif assistant_personality == "Professional":
-            personality_prefix = "You are a professional assistant. "
-
-        if "what's the time" in text.lower() or "what is the time" in text.lower():
-            current_time = datetime.now().strftime('%I:%M %p')
-            message = f"The current time is {current_time}."
-            return message
-
-        # Use AI response using g4f
-        response = ChatCompletion.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": personality_prefix + "You are an AI assistant."},
-                {"role": "user", "content": text}
-            ]
-        )
-        return response.strip()
-
+        return ''.join(ai_process_tokens(text, session)).strip()
     except Exception as e:
         logging.error(f"Error in ai_process: {e}")
         return f"Error: {e}"
 
-def ai_process_stream(text):
+# Frame a chunk as one server-sent event; multi-line text needs one data: line per line
+def format_sse_data(chunk):
+    return ''.join(f"data: {line}\n" for line in chunk.split('\n')) + "\n"
+
+def ai_process_stream(text, session=VOICE_SESSION):
     try:
         settings = get_settings()
         voice_enabled = settings['voice_enabled']
+        # Start speaking each sentence as soon as it is complete
+        speech = SpeechPipeline(speech_worker.say) if voice_enabled else None
 
-        full_response = ai_process(text)
+        parts = []
+        try:
+            for chunk in ai_process_tokens(text, session):
+                parts.append(chunk)
+                if speech is not None:
+                    speech.feed(chunk)
+                yield format_sse_data(chunk)
+        finally:
+            if speech is not None:
+                speech.close()
+        full_response = ''.join(parts).strip()
 
         log_request(text, full_response)
 
-        chunk_size = 50
-        for i in range(0, len(full_response), chunk_size):
-            chunk = full_response[i:i+chunk_size]
-            yield f"data: {chunk}\n\n"
-            time.sleep(0.05)
-
-        if voice_enabled:
-            # Split the response into smaller chunks for TTS
-            tts_chunk_size = 500  # Adjust based on your needs
-            with tts_lock:
-                local_tts_engine = pyttsx3.init()
-                local_tts_engine.setProperty('rate', 150)
-                local_tts_engine.setProperty('volume', 0.9)
-                for i in range(0, len(full_response), tts_chunk_size):
-                    tts_chunk = full_response[i:i+tts_chunk_size]
-                    local_tts_engine.say(tts_chunk)
-                local_tts_engine.runAndWait()
-
-        global current_speech, last_activation_time
-        current_speech = f"Assistant: {full_response}"
+        global last_activation_time
+        set_current_speech(f"Assistant: {full_response}")
         last_activation_time = time.time()
         add_to_chat_history(text, full_response)
 
     except Exception as e:
         logging.error(f"Error in ai_process_stream: {e}")
-        yield f"data: Error: {e}\n\n"
+        yield format_sse_data(f"Error: {e}")
 
-def process_ai_response(text):
-    global current_speech, last_activation_time
+# Runs on the turn pool; a newer turn cancels this one and cuts its speech
+def process_ai_response(text, turn=None):
+    global last_activation_time
     settings = get_settings()
     voice_enabled = settings['voice_enabled']
+    speak = speech_worker.say if turn is None else turn.ordered(speech_worker.say)
+    speech = SpeechPipeline(speak) if voice_enabled else None
 
-    ai_response = ai_process(text)
-    current_speech = f"Assistant: {ai_response}"
+    parts = []
+    try:
+        for chunk in ai_process_tokens(text):
+            if turn is not None and turn.is_cancelled():
+                break
+            parts.append(chunk)
+            if speech is not None:
+                speech.feed(chunk)
+        ai_response = ''.join(parts).strip()
+    except Exception as e:
+        logging.error(f"Error in ai_process: {e}")
+        ai_response = f"Error: {e}"
+        if speech is not None:
+            # The details go to the dashboard; the spoken apology is always the same cached clip
+            speech.discard()
+            speak(SPOKEN_ERROR_TEXT, cacheable=True)
+
+    # Publish results in turn order, and not at all for a superseded turn
+    if turn is not None and not turn.wait_for_delivery():
+        logging.info(f"Turn superseded, dropping reply to: '{text}'")
+        return
+
+    set_current_speech(f"Assistant: {ai_response}")
     last_activation_time = time.time()
     add_to_chat_history(text, ai_response)
     log_request(text, ai_response)
 
-    if voice_enabled:
-        # Split the response into smaller chunks for TTS
-        tts_chunk_size = 500  # Adjust based on your needs
-        with tts_lock:
-            local_tts_engine = pyttsx3.init()
-            local_tts_engine.setProperty('rate', 150)
-            local_tts_engine.setProperty('volume', 0.9)
-            for i in range(0, len(ai_response), tts_chunk_size):
-                tts_chunk = ai_response[i:i+tts_chunk_size]
-                local_tts_engine.say(tts_chunk)
-            local_tts_engine.runAndWait()
+    if speech is not None:
+        speech.close()
 
 def listen_loop():
-    global assistant_active, last_activation_time, kill_switch_activated, current_speech
-    recognizer = sr.Recognizer()
-    microphone = sr.Microphone()
+    global last_activation_time, kill_switch_activated
+    audio_capture.start()
+    # One reader for the whole loop, so no audio is skipped between phrases
+    buffered_source = audio_capture.source()
+
+    # Show what the user is saying while they say it (streaming backends only)
+    def show_partial(text):
+        if assistant_active:
+            set_current_speech(f"You said: {text}...")
 
     while not kill_switch_activated:
+        # A failed microphone closes the capture stream; reopen it instead of spinning on it
+        if not audio_capture.is_alive():
+            audio_capture.restart()
+            buffered_source = audio_capture.source()
+            continue
         settings = get_settings()
         wake_word = settings['wake_word']
-        with microphone as source:
-            recognizer.adjust_for_ambient_noise(source)
+        with buffered_source as source:
             logging.info("Listening...")
             try:
-                audio = recognizer.listen(source, timeout=5)
-                text = recognizer.recognize_google(audio)
-                logging.info(f"Recognized: {text}")
+                chunks = endpointer.listen(source.stream, audio_capture.energy_threshold(), timeout=5)
+                phrase = listen_for_phrase(chunks, speech_backend, on_partial=show_partial)
+                # While idle, only phrases that sound like the wake word go to a cloud recognizer
+                samples = None
+                if not assistant_active:
+                    samples = phrase.samples
+                    if speech_backend.remote and not wake_spotter.might_match(samples, wake_word):
+                        continue
+                text = phrase.transcribe()
+                logging.info(f"Recognized: {text} (endpoint after {endpointer.last_endpoint_delay * 1000:.0f} ms)")
 
                 if not assistant_active and wake_word.lower() in text.lower():
-                    assistant_active = True
+                    wake_spotter.enroll(samples, wake_word, text)
+                    set_assistant_active(True)
                     last_activation_time = time.time()
-                    threading.Thread(target=trigger_greeting).start()
+                    turn_pool.submit(trigger_greeting)
                 elif assistant_active:
-                    current_speech = f"You said: {text}"
-                    threading.Thread(target=process_ai_response, args=(text,)).start()
+                    set_current_speech(f"You said: {text}")
+                    turn_pool.submit(process_ai_response, text)
 
             except sr.WaitTimeoutError:
                 pass
@@ -280,56 +461,55 @@ def listen_loop():
                 logging.error(f"Error in listen_loop: {e}")
 
         if assistant_active and (time.time() - last_activation_time) > 300:
-            assistant_active = False
+            set_assistant_active(False)
             logging.info("Assistant deactivated due to timeout.")
 
     logging.info("Kill switch activated. Exiting listen loop.")
 
+# Reacts to each sample receive_pi_data publishes, instead of polling pi_data
 def sensor_monitor():
-    global assistant_active, last_activation_time
-    while not kill_switch_activated:
-        try:
-            conn = sqlite3.connect('assistant.db')
-            c = conn.cursor()
-            c.execute('''
-                SELECT sensor_distance
-                FROM pi_data
-                ORDER BY id DESC
-                LIMIT 1
-            ''')
-            row = c.fetchone()
-            conn.close()
-            if row:
-                distance = row[0]
-                settings = get_settings()
-                if settings.get('sensor_enabled', True):
-                    if distance is not None and 10 <= distance <= 50:
-                        if not assistant_active:
-                            assistant_active = True
-                            threading.Thread(target=trigger_greeting).start()
-                        last_activation_time = time.time()
-            time.sleep(0.5)
-        except Exception as e:
-            logging.error(f"Error in sensor_monitor: {e}")
-            time.sleep(1)
+    q = event_bus.subscribe()
+    try:
+        while not kill_switch_activated:
+            try:
+                topic, data = q.get(timeout=1)
+            except queue.Empty:
+                continue
+            if topic != 'pi_data':
+                continue  # other events, or a resync after falling behind; the next sample will do
+            if not data.get('fresh'):
+                continue  # replayed from the Pi's spool; nobody is standing there now
+            try:
+                on_sensor_distance(data['sensor_distance'])
+            except Exception as e:
+                logging.error(f"Error in sensor_monitor: {e}")
+    finally:
+        event_bus.unsubscribe(q)
 
-def trigger_greeting():
-    global current_speech, assistant_active, last_activation_time
-    greeting_text = "Hello! How can I assist you today?"
+def on_sensor_distance(distance):
+    global last_activation_time
+    settings = get_settings()
+    if settings.get('sensor_enabled', True):
+        if distance is not None and 10 <= distance <= 50:
+            if not assistant_active:
+                set_assistant_active(True)
+                # Don't cut off a reply that is already being spoken
+                turn_pool.submit(trigger_greeting, supersede=False)
+            last_activation_time = time.time()
+
+def trigger_greeting(turn=None):
+    global last_activation_time
+    greeting_text = GREETING_TEXT
     settings = get_settings()
     voice_enabled = settings['voice_enabled']
 
-    current_speech = f"Assistant: {greeting_text}"
+    set_current_speech(f"Assistant: {greeting_text}")
     add_to_chat_history("Sensor Triggered", greeting_text)
     log_request("Sensor Triggered", greeting_text)
 
     if voice_enabled:
-        with tts_lock:
-            local_tts_engine = pyttsx3.init()
-            local_tts_engine.setProperty('rate', 150)
-            local_tts_engine.setProperty('volume', 0.9)
-            local_tts_engine.say(greeting_text)
-            local_tts_engine.runAndWait()
+        speak = speech_worker.say if turn is None else turn.ordered(speech_worker.say)
+        speak(greeting_text, priority=PRIORITY_HIGH, cacheable=True)
 
     last_activation_time = time.time()
 
@@ -339,38 +519,18 @@ def index():
 
 @app.route('/api/status', methods=['GET'])
 def get_status():
-    stats = get_system_stats()
+    try:
+        windows = parse_stats_windows()
+    except ValueError:
+        return jsonify({'error': 'Invalid windows parameter'}), 400
+    stats = get_system_stats(windows)
     chat_history = get_chat_history()
     settings = get_settings()
-    conn = sqlite3.connect('assistant.db')
-    c = conn.cursor()
-    c.execute('SELECT timestamp, user_text, assistant_response FROM requests ORDER BY id DESC LIMIT 100')
-    requests_rows = c.fetchall()
-    conn.close()
+    requests_rows = db.fetchall('SELECT timestamp, user_text, assistant_response FROM requests ORDER BY id DESC LIMIT 100')
     requests_history = [{'timestamp': row[0], 'user_text': row[1], 'assistant_response': row[2]} for row in requests_rows]
 
-    latest_pi_data = {}
-    try:
-        conn = sqlite3.connect('assistant.db')
-        c = conn.cursor()
-        c.execute('''
-            SELECT cpu_usage, memory_usage, cpu_temp, sensor_distance
-            FROM pi_data
-            ORDER BY id DESC
-            LIMIT 1
-        ''')
-        row = c.fetchone()
-        conn.close()
-        if row:
-            cpu_usage, memory_usage, cpu_temp, sensor_distance = row
-            latest_pi_data = {
-                'cpu_usage': cpu_usage,
-                'memory_usage': memory_usage,
-                'cpu_temp': cpu_temp,
-                'sensor_distance': sensor_distance
-            }
-    except Exception as e:
-        logging.error(f"Error fetching latest Pi data: {e}")
+    # Recent Pi telemetry comes from the in-memory window, not pi_data
+    latest_pi_data = pi_window.latest() or {}
 
     return jsonify({
         'current_speech': current_speech,
@@ -378,23 +538,65 @@ def get_status():
         'stats': stats,
         'chat_history': chat_history,
         'settings': settings,
+        'settings_version': get_settings_version(),
+        'turns': turn_pool.stats(),
+        'audio': audio_capture.stats(),
+        'wake_word': wake_spotter.stats(),
+        'vad': endpointer.stats(),
+        'speech': {
+            'speaking': speech_worker.is_speaking(),
+            'pending': speech_worker.pending(),
+            'audio_cache': audio_cache.stats()
+        },
+        'llm_metrics': {
+            'time_to_first_token': llm_ttft.summary(),
+            'tokens_per_sec': llm_tokens_per_sec.summary(),
+            'router': llm.stats()
+        },
+        'response_cache': response_cache.stats(),
+        'semantic_cache': semantic_cache.stats(),
+        'conversation': conversation.stats(),
         'pi_data': latest_pi_data,
+        'pi_recent': pi_window.summary(PI_RECENT_SECONDS),
+        'telemetry': telemetry.stats(),
+        'pi_data_sink': pi_data_sink.stats(),
         'requests_history': requests_history
     })
 
+# Push state changes to the dashboard instead of having it poll /api/status
+@app.route('/api/events', methods=['GET'])
+def event_stream():
+    def stream():
+        q = event_bus.subscribe()
+        try:
+            yield 'retry: 3000\n\n'
+            while not kill_switch_activated:
+                try:
+                    topic, data = q.get(timeout=15)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'  # stops proxies from closing an idle stream
+                    continue
+                yield format_sse(topic, data)
+        finally:
+            event_bus.unsubscribe(q)
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/kill', methods=['POST'])
 def kill():
     global kill_switch_activated
     kill_switch_activated = True
+    turn_pool.cancel_all()
+    speech_worker.interrupt()
     return jsonify({'status': 'Assistant has been stopped.'})
 
 @app.route('/api/text_input', methods=['POST'])
 def text_input():
     data = request.get_json()
     user_text = data.get('text', '')
+    session = data.get('session_id') or DASHBOARD_SESSION
     if user_text:
         def generate():
-            yield from ai_process_stream(user_text)
+            yield from ai_process_stream(user_text, session)
         return Response(generate(), mimetype='text/event-stream')
     else:
         return jsonify({'error': 'No text provided.'}), 400
@@ -413,56 +615,57 @@ def update_settings():
 
 @app.route('/api/pi_data', methods=['POST'])
 def receive_pi_data():
-    data = request.get_json()
-    timestamp = data.get('timestamp')
-    cpu_usage = data.get('cpu_usage')
-    memory_usage = data.get('memory_usage')
-    cpu_temp = data.get('cpu_temp')
-    sensor_distance = data.get('sensor_distance')
-
-    if None in (timestamp, cpu_usage, memory_usage, sensor_distance):
-        return jsonify({'error': 'Incomplete data received.'}), 400
-
+    # One sample, or a gzip'd batch from an agent that was offline or batching
     try:
-        conn = sqlite3.connect('assistant.db')
-        c = conn.cursor()
-        c.execute('''
-            INSERT INTO pi_data (timestamp, cpu_usage, memory_usage, cpu_temp, sensor_distance)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (timestamp, cpu_usage, memory_usage, cpu_temp, sensor_distance))
-        conn.commit()
-        conn.close()
-        return jsonify({'status': 'Data received successfully.'}), 200
+        samples, sent_at = pi_ingest.read_samples(request.get_data(), request.headers.get('Content-Encoding'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Every sample is stored, the database copy in the background. If the write
+    # queue is full the batch is refused before anything else sees it, so the
+    # Pi spools it and the retry isn't counted twice.
+    if not pi_data_sink.put_many([pi_ingest.as_row(sample) for sample in samples]):
+        logging.warning("Pi data write queue is full, asking the Pi to retry.")
+        return jsonify({'error': 'Pi data write queue is full, retry later.'}), 503
+
+    # sensor_monitor and the dashboards get the newest sample straight away
+    latest = pi_ingest.newest(samples)
+    event_bus.publish('pi_data', {**{field: latest.get(field) for field in pi_ingest.FIELDS},
+                                  'fresh': pi_ingest.is_fresh(latest, sent_at)})
+    telemetry.add(samples)
+    pi_window.add(samples)
+    return jsonify({'status': 'Data received successfully.', 'received': len(samples)}), 200
+
+# Chart data from the telemetry rollups; from/to default to the last hour,
+# step (seconds) to the finest that keeps the response small
+@app.route('/api/pi_history', methods=['GET'])
+def get_pi_history():
+    try:
+        end = parse_time_arg(request.args.get('to', time.time()))
+        start = parse_time_arg(request.args.get('from', end - 60 * 60))
+        step = request.args.get('step')
+        if start >= end:
+            raise ValueError("'from' must be before 'to'")
+        return jsonify(telemetry.history(start, end, int(step) if step else None)), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        logging.error(f"Error inserting Pi data into database: {e}")
-        return jsonify({'error': 'Failed to insert data into database.'}), 500
+        logging.error(f"Error fetching Pi history: {e}")
+        return jsonify({'error': 'Failed to fetch Pi history.'}), 500
 
 @app.route('/api/pi_latest_data', methods=['GET'])
 def get_latest_pi_data():
-    try:
-        conn = sqlite3.connect('assistant.db')
-        c = conn.cursor()
-        c.execute('''
-            SELECT cpu_usage, memory_usage, cpu_temp, sensor_distance
-            FROM pi_data
-            ORDER BY id DESC
-            LIMIT 1
-        ''')
-        row = c.fetchone()
-        conn.close()
-        if row:
-            cpu_usage, memory_usage, cpu_temp, sensor_distance = row
-            return jsonify({
-                'cpu_usage': cpu_usage,
-                'memory_usage': memory_usage,
-                'cpu_temp': cpu_temp,
-                'sensor_distance': sensor_distance
-            }), 200
-        else:
-            return jsonify({'error': 'No Pi data available.'}), 404
-    except Exception as e:
-        logging.error(f"Error fetching latest Pi data: {e}")
-        return jsonify({'error': 'Failed to fetch Pi data.'}), 500
+    latest = pi_window.latest()
+    if latest is None:
+        return jsonify({'error': 'No Pi data available.'}), 404
+    # ?window=SECONDS adds rolling mean/min/max/percentiles over that span
+    seconds = request.args.get('window')
+    if seconds is not None:
+        try:
+            latest['recent'] = pi_window.summary(float(seconds))
+        except ValueError:
+            return jsonify({'error': 'Invalid window parameter'}), 400
+    return jsonify(latest), 200
 
 def start_server():
     app.run(host='0.0.0.0', port=5000, use_reloader=False, threaded=True)
@@ -471,6 +674,15 @@ if __name__ == '__main__':
     # Set up logging
     logging.basicConfig(level=logging.INFO)
 
+    stats_sampler.start()
+    pi_data_sink.start()
+    telemetry.start()
+    speech_worker.start()
+    turn_pool.start()
+    speech_worker.warm(CACHED_PHRASES)
+    response_cache.purge_expired()
+    load_pi_window()
+
     listen_thread = threading.Thread(target=listen_loop, daemon=True)
     listen_thread.start()
 
@@ -490,4 +702,6 @@ if __name__ == '__main__':
         kill_switch_activated = True
         listen_thread.join()
         sensor_thread.join()
+        telemetry.stop()
+        pi_data_sink.stop()
         logging.info("Assistant has been stopped.")
@@ -0,0 +1,86 @@
+# Request bodies for /api/pi_data
+#
+# The Pi agent posts batches as gzip'd JSON ({"samples": [...]}) over a
+# keep-alive session; older agents post a single plain JSON sample. Both are
+# turned into a list of samples here so the route can store them with one
+# executemany in one transaction.
+#
+# Batches carry sent_at, when the Pi posted them by its own clock. A sample's
+# age is measured against that rather than the server's clock, so a spool
+# replay is told apart from live readings even if the Pi's clock is off.
+import json
+import math
+import time
+import zlib
+from telemetry import parse_timestamp, format_timestamp
+
+FIELDS = ('timestamp', 'cpu_usage', 'memory_usage', 'cpu_temp', 'sensor_distance')
+REQUIRED = ('timestamp', 'cpu_usage', 'memory_usage', 'sensor_distance')
+NUMERIC = ('cpu_usage', 'memory_usage', 'cpu_temp', 'sensor_distance')
+MAX_BATCH = 1000                 # samples per request
+MAX_BODY_BYTES = 4 * 1024 * 1024 # decompressed, so a small gzip body can't expand without limit
+FRESH_SECONDS = 10               # samples older than this when sent are history (e.g. a spool replay)
+
+# (samples, sent_at). A plain single sample is posted as soon as it is read,
+# so its own timestamp stands in for sent_at. Raises ValueError with a
+# message fit for the client if the body is unusable.
+def read_samples(body, content_encoding=None):
+    if content_encoding == 'gzip':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            body = decompressor.decompress(body, MAX_BODY_BYTES)
+        except zlib.error:
+            raise ValueError('Invalid gzip body.')
+        if decompressor.unconsumed_tail:
+            raise ValueError('Batch too large.')
+    try:
+        data = json.loads(body)
+    except ValueError:
+        raise ValueError('Invalid JSON.')
+
+    batch = isinstance(data, dict) and 'samples' in data
+    samples = data.get('samples') if batch else [data]
+    if not isinstance(samples, list) or not samples:
+        raise ValueError('No samples received.')
+    if len(samples) > MAX_BATCH:
+        raise ValueError('Batch too large.')
+    for sample in samples:
+        if not isinstance(sample, dict) or any(sample.get(field) is None for field in REQUIRED):
+            raise ValueError('Incomplete data received.')
+        # Checked here so a bad sample is a 400 for the whole batch, not a 500
+        # after some of it is stored (which the Pi would spool and send again)
+        if parse_timestamp(sample['timestamp']) is None:
+            raise ValueError(f"Invalid timestamp '{sample['timestamp']}'.")
+        for field in NUMERIC:
+            if sample.get(field) is not None and not is_number(sample[field]):
+                raise ValueError(f"Invalid {field} '{sample[field]}'.")
+
+    if not batch:
+        return samples, parse_timestamp(samples[0]['timestamp'])
+    if data.get('sent_at') is None:
+        return samples, None  # an agent from before sent_at; is_fresh falls back to the server clock
+    sent_at = parse_timestamp(data['sent_at'])
+    if sent_at is None:
+        raise ValueError(f"Invalid sent_at '{data['sent_at']}'.")
+    return samples, sent_at
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+# The timestamp is stored as TIMESTAMP_FORMAT whatever the Pi sent (epoch
+# seconds, ISO 8601), so the text comparisons in queries and purges order it
+def as_row(sample):
+    row = {field: sample.get(field) for field in FIELDS}
+    row['timestamp'] = format_timestamp(parse_timestamp(sample['timestamp']))
+    return tuple(row.values())
+
+# The sample with the latest timestamp; a replayed batch is one event, not hundreds
+def newest(samples):
+    return max(samples, key=lambda sample: parse_timestamp(sample.get('timestamp')) or 0.0)
+
+# Whether a sample described the present when it was sent, so presence logic
+# can ignore replayed history; sent_at comes from read_samples
+def is_fresh(sample, sent_at=None):
+    epoch = parse_timestamp(sample.get('timestamp'))
+    now = time.time() if sent_at is None else sent_at
+    return epoch is not None and abs(now - epoch) <= FRESH_SECONDS
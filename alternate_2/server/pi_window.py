@@ -0,0 +1,75 @@
+# The last few minutes of Pi telemetry, held in NumPy columns
+#
+# /api/status and /api/pi_latest_data used to query pi_data and build dicts
+# on every call, although they only ever look at recent samples. The window
+# is a fixed-size ring of float64 columns fed by receive_pi_data; the latest
+# sample is one index lookup and rolling means/percentiles over the last N
+# seconds are a mask and a few vectorized reductions, with no database read.
+import threading
+import numpy as np
+from telemetry import METRICS, parse_timestamp
+
+WINDOW_SIZE = 900            # samples; 15 minutes at the Pi's one per second
+COLUMNS = ('timestamp',) + METRICS
+
+def _value(x):
+    return None if np.isnan(x) else float(x)
+
+class TelemetryWindow:
+    def __init__(self, capacity=WINDOW_SIZE):
+        self.capacity = capacity
+        self.columns = {name: np.full(capacity, np.nan) for name in COLUMNS}
+        self.written = 0     # total samples ever added; the newest is at (written - 1) % capacity
+        self._lock = threading.Lock()
+
+    # samples are dicts with a timestamp and METRICS; missing values become NaN
+    def add(self, samples):
+        samples = samples[-self.capacity:]
+        if not samples:
+            return
+        rows = np.array([[parse_timestamp(s.get('timestamp'))] + [s.get(m) for m in METRICS] for s in samples], dtype=np.float64)
+        with self._lock:
+            indices = (self.written + np.arange(len(rows))) % self.capacity
+            for j, name in enumerate(COLUMNS):
+                self.columns[name][indices] = rows[:, j]
+            self.written += len(rows)
+
+    def __len__(self):
+        return min(self.written, self.capacity)
+
+    # The most recent sample as {metric: value}, or None before the first one
+    def latest(self):
+        with self._lock:
+            if not self.written:
+                return None
+            i = (self.written - 1) % self.capacity
+            return {metric: _value(self.columns[metric][i]) for metric in METRICS}
+
+    # Mean, min, max, p50 and p95 per metric over the last `seconds` of sample
+    # time (measured from the newest sample, so the Pi's clock doesn't matter)
+    def summary(self, seconds):
+        with self._lock:
+            n = len(self)
+            columns = {name: self.columns[name][:n].copy() for name in COLUMNS}
+        result = {'seconds': seconds, 'samples': 0}
+        timestamps = columns['timestamp']
+        if not n or np.isnan(timestamps).all():
+            result.update({metric: None for metric in METRICS})
+            return result
+        mask = timestamps >= np.nanmax(timestamps) - seconds
+        result['samples'] = int(mask.sum())
+        for metric in METRICS:
+            values = columns[metric][mask]
+            values = values[~np.isnan(values)]
+            if not len(values):
+                result[metric] = None
+                continue
+            p50, p95 = np.percentile(values, (50, 95))
+            result[metric] = {
+                'mean': round(float(values.mean()), 2),
+                'min': float(values.min()),
+                'max': float(values.max()),
+                'p50': round(float(p50), 2),
+                'p95': round(float(p95), 2)
+            }
+        return result
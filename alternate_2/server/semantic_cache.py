@@ -0,0 +1,149 @@
+# Near-duplicate cache of LLM replies
+#
+# The exact cache in response_cache.py misses on small wording changes that
+# speech recognition produces all the time ("what's your name" vs "what is
+# your name"). Here every prompt is turned into a hashed character n-gram
+# vector, which needs no model download and runs on any CPU, and the vectors
+# sit in one NumPy matrix so a lookup is a single matrix-vector product. The
+# closest earlier prompt wins if its cosine similarity clears the threshold.
+#
+# Similar spelling isn't similar meaning ("president of india" / "president
+# of indiana" score 0.93), so an answer is only reused between prompts with
+# the same content words; the vectors absorb the rest (filler words, word
+# order, contractions, punctuation).
+import re
+import time
+import zlib
+import threading
+import numpy as np
+
+EMBEDDING_DIM = 256
+NGRAM_SIZES = (3, 4, 5)
+DEFAULT_THRESHOLD = 0.9      # cosine similarity needed to reuse an answer
+DEFAULT_TTL = 24 * 60 * 60   # seconds an answer stays valid
+MAX_ENTRIES = 10000          # oldest entries are overwritten past this
+
+CONTRACTIONS = [
+    (re.compile(r"\b(\w+)'s\b"), r'\1 is'),
+    (re.compile(r"\bcan't\b"), 'can not'),
+    (re.compile(r"\bwon't\b"), 'will not'),
+    (re.compile(r"n't\b"), ' not'),
+    (re.compile(r"'re\b"), ' are'),
+    (re.compile(r"'m\b"), ' am'),
+    (re.compile(r"'ll\b"), ' will'),
+    (re.compile(r"'ve\b"), ' have'),
+    (re.compile(r"'d\b"), ' would'),
+]
+NON_WORD = re.compile(r'[^\w\s]')
+WHITESPACE = re.compile(r'\s+')
+NUMBER = re.compile(r'\d+(?:\.\d+)?')
+# Words that don't change what is being asked; negations and question words stay content
+STOPWORDS = frozenset('''
+    a an the is are was were be been am do does did can could would will shall should may might
+    i me my we us our you your it its this that these those there here of to in on at for with
+    about and or so just please tell hey ok okay some any
+'''.split())
+
+def normalize(text):
+    text = text.lower().replace('’', "'")
+    for pattern, replacement in CONTRACTIONS:
+        text = pattern.sub(replacement, text)
+    text = NON_WORD.sub(' ', text)
+    return WHITESPACE.sub(' ', text).strip()
+
+# Signed feature hashing of character n-grams (plus whole words) into a unit vector
+def embed(text, dim=EMBEDDING_DIM):
+    vector = np.zeros(dim, dtype=np.float32)
+    normalized = normalize(text)
+    padded = f' {normalized} '
+    features = normalized.split()
+    for n in NGRAM_SIZES:
+        features.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+    for feature in features:
+        h = zlib.crc32(feature.encode('utf-8'))
+        vector[h % dim] += 1.0 if (h >> 16) & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector /= norm
+    return vector
+
+# Content words with a plural 's' dropped, so "tell me a joke" matches "jokes" but not "india" / "indiana"
+def content_words(text):
+    words = set()
+    for word in normalize(text).split():
+        if word in STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        words.add(word)
+    return frozenset(words)
+
+class SemanticCache:
+    def __init__(self, threshold=DEFAULT_THRESHOLD, ttl=DEFAULT_TTL, max_entries=MAX_ENTRIES, dim=EMBEDDING_DIM):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.dim = dim
+        self.hits = 0
+        self.misses = 0
+        self.last_similarity = None
+        # Preallocated ring of slots; rows past _size are unused
+        self._vectors = np.zeros((max_entries, dim), dtype=np.float32)
+        self._groups = np.zeros(max_entries, dtype=np.int64)
+        self._expires = np.zeros(max_entries, dtype=np.float64)
+        self._responses = [None] * max_entries
+        self._size = 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    # Answers are only shared between prompts with the same personality, model,
+    # numbers and content words, so "what is 2 plus 3" never reuses the answer
+    # for "2 plus 4". Rows store a hash of the group, so nothing grows per group.
+    @staticmethod
+    def _group(text, personality, model):
+        return hash((personality, model, tuple(NUMBER.findall(text)), content_words(text)))
+
+    def lookup(self, text, personality, model):
+        vector = embed(text, self.dim)
+        group = self._group(text, personality, model)
+        with self._lock:
+            size = self._size
+            if size == 0:
+                self.misses += 1
+                return None
+            scores = self._vectors[:size] @ vector
+            scores[(self._groups[:size] != group) | (self._expires[:size] <= time.time())] = -1.0
+            best = int(np.argmax(scores))
+            similarity = float(scores[best])
+            self.last_similarity = similarity
+            if similarity < self.threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return self._responses[best]
+
+    def add(self, text, personality, model, response, ttl=None):
+        if not response:
+            return
+        vector = embed(text, self.dim)
+        group = self._group(text, personality, model)
+        with self._lock:
+            slot = self._next
+            self._vectors[slot] = vector
+            self._groups[slot] = group
+            self._expires[slot] = time.time() + (self.ttl if ttl is None else ttl)
+            self._responses[slot] = response
+            self._next = (slot + 1) % self.max_entries
+            self._size = max(self._size, slot + 1)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': self._size,
+                'threshold': self.threshold,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'last_similarity': None if self.last_similarity is None else round(self.last_similarity, 4)
+            }
@@ -0,0 +1,258 @@
+# Streaming text-to-speech helpers
+#
+# The LLM reply arrives as a stream of small chunks. SentenceSegmenter turns
+# that stream into whole sentences and SpeechPipeline hands each one to the
+# SpeechWorker as soon as it is complete, so the first sentence is spoken
+# while the rest of the answer is still being generated.
+import os
+import re
+import queue
+import logging
+import itertools
+import threading
+import pyttsx3
+from audio_cache import AudioCache, WavPlayer
+
+MAX_QUEUED_UTTERANCES = 64   # bounded so a stalled engine can't grow memory forever
+MAX_SENTENCE_CHARS = 300     # force a break (at a word boundary) past this length
+
+# Sentence end: terminal punctuation, optional closing quotes/brackets, then whitespace
+SENTENCE_END = re.compile(r'[.!?]+["\')\]]*(?=\s)|\n+')
+ABBREVIATIONS = {'mr', 'mrs', 'ms', 'dr', 'prof', 'sr', 'jr', 'st', 'vs', 'etc', 'e.g', 'i.e', 'approx', 'no'}
+SOFT_BREAK = re.compile(r'[,;:]\s')
+
+# Lower numbers are spoken first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BACKGROUND = 2  # pre-rendering cached phrases when nothing else is queued
+
+class SentenceSegmenter:
+    def __init__(self, max_chars=MAX_SENTENCE_CHARS):
+        self.max_chars = max_chars
+        self.buffer = ''
+
+    # Add streamed text and return any sentences it completed
+    def feed(self, text):
+        self.buffer += text
+        sentences = []
+        while True:
+            sentence = self._next_sentence()
+            if sentence is None:
+                break
+            if sentence:
+                sentences.append(sentence)
+        return sentences
+
+    # Return whatever is left once the stream has ended
+    def flush(self):
+        rest = self.buffer.strip()
+        self.buffer = ''
+        return rest or None
+
+    def _next_sentence(self):
+        for match in SENTENCE_END.finditer(self.buffer):
+            if match.group().startswith('.') and self._is_abbreviation(match.start()):
+                continue
+            return self._cut(match.end())
+
+        if len(self.buffer) > self.max_chars:
+            return self._cut(self._break_point())
+        return None
+
+    def _is_abbreviation(self, dot_index):
+        head = self.buffer[:dot_index]
+        parts = head.rsplit(None, 1)
+        if not parts:
+            return False
+        word = parts[-1].lower().lstrip('("\'')
+        if word.isdigit():
+            # "1." at the start of a line is a list marker, not the end of a sentence
+            before = head[:len(head) - len(parts[-1])].rstrip(' \t')
+            return not before or before.endswith('\n')
+        # Single letters are initials ("J. R. R. Tolkien")
+        return word in ABBREVIATIONS or len(word) == 1
+
+    def _break_point(self):
+        window = self.buffer[:self.max_chars]
+        soft = [m.end() for m in SOFT_BREAK.finditer(window)]
+        if soft:
+            return soft[-1]
+        space = window.rfind(' ')
+        return space + 1 if space > 0 else self.max_chars
+
+    def _cut(self, index):
+        sentence = self.buffer[:index].strip()
+        self.buffer = self.buffer[index:]
+        return sentence
+
+# Feeds sentences from a token stream to a speak() callable as they complete
+class SpeechPipeline:
+    def __init__(self, speak, priority=PRIORITY_NORMAL):
+        self.segmenter = SentenceSegmenter()
+        self.speak = speak
+        self.priority = priority
+        self.last_utterance = None
+
+    def feed(self, text):
+        for sentence in self.segmenter.feed(text):
+            self.last_utterance = self.speak(sentence, priority=self.priority)
+
+    # Drop the partial sentence not yet spoken, e.g. when the reply failed
+    # mid-stream and close() shouldn't speak a fragment of it
+    def discard(self):
+        self.segmenter.flush()
+
+    # Flush the last partial sentence; optionally wait until everything is spoken
+    def close(self, wait=False, timeout=None):
+        rest = self.segmenter.flush()
+        if rest:
+            self.last_utterance = self.speak(rest, priority=self.priority)
+        if wait and self.last_utterance is not None:
+            self.last_utterance.wait(timeout)
+
+class Utterance:
+    def __init__(self, text, priority, generation, cacheable=False, render_only=False):
+        self.text = text
+        self.priority = priority
+        self.generation = generation
+        self.cacheable = cacheable      # render to the audio cache after speaking it live
+        self.render_only = render_only  # warm-up job: write the audio file, don't speak
+        self.spoken = False
+        self.done = threading.Event()
+
+    def wait(self, timeout=None):
+        return self.done.wait(timeout)
+
+# One long-lived thread that owns the only pyttsx3 engine
+#
+# pyttsx3.init() is slow and the engine is not safe to share across threads,
+# so every utterance goes through this worker's priority queue. say() never
+# blocks; interrupt() drops everything queued and cuts the current utterance
+# at the next word boundary. With an AudioCache attached, phrases that have
+# been rendered before play straight from their WAV file.
+class SpeechWorker:
+    def __init__(self, rate=150, volume=0.9, voice=None, audio_cache=None, max_queued=MAX_QUEUED_UTTERANCES):
+        self.rate = rate
+        self.volume = volume
+        self.voice = voice
+        self.audio_cache = audio_cache
+        self._player = WavPlayer()
+        self._queue = queue.PriorityQueue(maxsize=max_queued)
+        self._sequence = itertools.count()  # keeps FIFO order within a priority
+        self._generation = 0                # bumped by interrupt() to invalidate queued speech
+        self._current = None
+        self._engine = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='speech-worker', daemon=True)
+                self._thread.start()
+
+    def say(self, text, priority=PRIORITY_NORMAL, cacheable=False):
+        return self._enqueue(Utterance(text, priority, self._generation, cacheable=cacheable))
+
+    # Render phrases into the audio cache in the background so they play instantly later
+    def warm(self, phrases):
+        if self.audio_cache is None:
+            return
+        for text in phrases:
+            if not self.audio_cache.contains(self._cache_key(text)):
+                self._enqueue(Utterance(text, PRIORITY_BACKGROUND, self._generation, render_only=True))
+
+    def _enqueue(self, utterance):
+        self.start()
+        try:
+            self._queue.put_nowait((utterance.priority, next(self._sequence), utterance))
+        except queue.Full:
+            logging.warning(f"Speech queue full, dropping utterance: '{utterance.text[:40]}'")
+            utterance.done.set()
+        return utterance
+
+    def _cache_key(self, text):
+        return AudioCache.key(text, self.voice or 'default', self.rate, self.volume)
+
+    def interrupt(self):
+        with self._lock:
+            self._generation += 1
+        # Drop queued utterances now so their waiters are released immediately
+        while True:
+            try:
+                _, _, utterance = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            utterance.done.set()
+        self._player.stop()
+
+    def is_speaking(self):
+        return self._current is not None
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _init_engine(self):
+        engine = pyttsx3.init()
+        engine.setProperty('rate', self.rate)
+        engine.setProperty('volume', self.volume)
+        if self.voice:
+            engine.setProperty('voice', self.voice)
+        # Called on this thread between words, which is the one safe place to stop the engine
+        engine.connect('started-word', self._on_word)
+        return engine
+
+    def _on_word(self, name, location, length):
+        current = self._current
+        if current is not None and current.generation != self._generation:
+            self._engine.stop()
+
+    def _run(self):
+        while True:
+            _, _, utterance = self._queue.get()
+            try:
+                if utterance.render_only:
+                    self._render(utterance.text)
+                    continue
+                if utterance.generation != self._generation:
+                    continue
+                self._current = utterance
+                self._speak(utterance)
+                utterance.spoken = utterance.generation == self._generation
+            except Exception as e:
+                logging.error(f"Error in speech worker: {e}")
+                self._engine = None  # re-create the engine on the next utterance
+            finally:
+                self._current = None
+                utterance.done.set()
+
+    def _speak(self, utterance):
+        cached_path = None
+        if self.audio_cache is not None:
+            # Only phrases marked cacheable count as misses; any other sentence
+            # can still hit if it matches a phrase that was warmed up
+            cached_path = self.audio_cache.get(self._cache_key(utterance.text), count_miss=utterance.cacheable)
+        if cached_path is not None:
+            self._player.play(cached_path)
+            return
+
+        if self._engine is None:
+            self._engine = self._init_engine()
+        self._engine.say(utterance.text)
+        self._engine.runAndWait()
+        if utterance.cacheable and self.audio_cache is not None:
+            self._enqueue(Utterance(utterance.text, PRIORITY_BACKGROUND, self._generation, render_only=True))
+
+    def _render(self, text):
+        key = self._cache_key(text)
+        if self.audio_cache.contains(key):
+            return
+        if self._engine is None:
+            self._engine = self._init_engine()
+        path = self.audio_cache.path_for(key)
+        partial = path + '.part'
+        self._engine.save_to_file(text, partial)
+        self._engine.runAndWait()
+        if os.path.exists(partial):
+            os.replace(partial, path)  # never leave a half-written file under the final name
+            self.audio_cache.add(key)
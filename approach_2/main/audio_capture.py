@@ -0,0 +1,199 @@
+# Continuous microphone capture into a ring buffer
+#
+# listen_loop used to re-open the microphone and run adjust_for_ambient_noise
+# on every pass, which threw away about a second of audio each time and cut
+# off anyone who started talking at the wrong moment. The microphone is now
+# opened once by a capture thread that writes PCM frames into a fixed-size
+# ring buffer and keeps a running noise-floor estimate. Consumers read from
+# the buffer with their own cursor, so nothing between two reads is lost.
+#
+# If the microphone fails to open or read, the capture thread closes the
+# buffer (so readers return instead of waiting forever) and exits; the
+# listen loop notices and calls restart(), which backs off between tries.
+import logging
+import threading
+import numpy as np
+import speech_recognition as sr
+
+SAMPLE_RATE = 16000
+CHUNK_SIZE = 480             # 30 ms frames at 16 kHz
+BUFFER_SECONDS = 30          # how far a slow consumer can fall behind before audio is dropped
+
+NOISE_FALL = 0.3             # the floor follows quieter frames quickly...
+NOISE_RISE = 0.002           # ...and creeps up slowly, so speech barely moves it
+NOISE_MARGIN = 2.5           # speech has to be this many times louder than the floor
+MIN_ENERGY_THRESHOLD = 150   # never go below this, even in a silent room
+RESTART_DELAY = 1.0          # seconds before reopening a failed microphone, doubling per failure...
+MAX_RESTART_DELAY = 30.0     # ...up to this
+
+def frame_rms(samples):
+    if len(samples) == 0:
+        return 0.0
+    return float(np.sqrt(np.mean(samples.astype(np.float32) ** 2)))
+
+class AudioRingBuffer:
+    def __init__(self, capacity, sample_rate=SAMPLE_RATE):
+        self.capacity = capacity
+        self.sample_rate = sample_rate
+        self.samples = np.zeros(capacity, dtype=np.int16)
+        self.written = 0        # total samples ever written; positions below are absolute
+        self.overruns = 0       # times a reader fell more than a full buffer behind
+        self.closed = False
+        self._condition = threading.Condition()
+
+    def write(self, samples):
+        with self._condition:
+            n = len(samples)
+            if n >= self.capacity:
+                samples = samples[-self.capacity:]
+                self.written += n - self.capacity
+                n = self.capacity
+            start = self.written % self.capacity
+            first = min(n, self.capacity - start)
+            self.samples[start:start + first] = samples[:first]
+            self.samples[:n - first] = samples[first:]
+            self.written += n
+            self._condition.notify_all()
+
+    # Return (samples, next_position) for up to count samples starting at position.
+    # Blocks until they are available; returns what there is on timeout or close.
+    def read(self, position, count, timeout=None):
+        with self._condition:
+            self._condition.wait_for(lambda: self.written >= position + count or self.closed, timeout)
+            oldest = self.written - self.capacity
+            if position < oldest:
+                self.overruns += 1
+                logging.warning(f"Audio reader fell behind, skipping {oldest - position} samples")
+                position = oldest
+            end = min(self.written, position + count)
+            indices = np.arange(position, end) % self.capacity
+            return self.samples[indices], end
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+class AudioCapture:
+    def __init__(self, sample_rate=SAMPLE_RATE, chunk_size=CHUNK_SIZE, buffer_seconds=BUFFER_SECONDS, device_index=None):
+        self.sample_rate = sample_rate
+        self.chunk_size = chunk_size
+        self.device_index = device_index
+        self.buffer = AudioRingBuffer(sample_rate * buffer_seconds, sample_rate)
+        self.noise_floor = None
+        self.restarts = 0
+        self._failures = 0           # in a row, without audio in between
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._stop_event.clear()
+                self._thread = threading.Thread(target=self._run, name='audio-capture', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self.buffer.close()
+
+    def is_alive(self):
+        thread = self._thread
+        return thread is not None and thread.is_alive()
+
+    # Reopen the microphone after the capture thread died, waiting longer after
+    # each failure in a row. Readers of the old buffer need a new source().
+    def restart(self):
+        delay = min(MAX_RESTART_DELAY, RESTART_DELAY * 2 ** max(0, self._failures - 1))
+        logging.warning(f"Audio capture stopped, reopening the microphone in {delay:.1f} s")
+        if self._stop_event.wait(delay):
+            return
+        with self._lock:
+            if self.is_alive():
+                return
+            self.buffer = AudioRingBuffer(self.buffer.capacity, self.sample_rate)
+            self._thread = None
+            self.restarts += 1
+        self.start()
+
+    def _run(self):
+        buffer = self.buffer
+        try:
+            microphone = sr.Microphone(device_index=self.device_index, sample_rate=self.sample_rate, chunk_size=self.chunk_size)
+            with microphone as source:
+                logging.info("Audio capture started.")
+                while not self._stop_event.is_set():
+                    data = source.stream.read(self.chunk_size)
+                    samples = np.frombuffer(data, dtype=np.int16)
+                    self._update_noise_floor(samples)
+                    buffer.write(samples)
+                    self._failures = 0
+        except Exception as e:
+            self._failures += 1
+            logging.error(f"Audio capture failed: {e}")
+        finally:
+            buffer.close()
+
+    # Asymmetric running estimate: one multiply-add per frame, no history kept
+    def _update_noise_floor(self, samples):
+        rms = frame_rms(samples)
+        if self.noise_floor is None:
+            self.noise_floor = rms
+        elif rms < self.noise_floor:
+            self.noise_floor += (rms - self.noise_floor) * NOISE_FALL
+        else:
+            self.noise_floor += (rms - self.noise_floor) * NOISE_RISE
+
+    def energy_threshold(self):
+        if self.noise_floor is None:
+            return MIN_ENERGY_THRESHOLD
+        return max(MIN_ENERGY_THRESHOLD, self.noise_floor * NOISE_MARGIN)
+
+    # A new reader that starts at the live edge of the buffer
+    def source(self):
+        return BufferedSource(self)
+
+    def stats(self):
+        return {
+            'noise_floor': None if self.noise_floor is None else round(self.noise_floor, 1),
+            'energy_threshold': round(self.energy_threshold(), 1),
+            'buffered_seconds': round(min(self.buffer.written, self.buffer.capacity) / self.sample_rate, 1),
+            'overruns': self.buffer.overruns,
+            'capturing': self.is_alive(),
+            'restarts': self.restarts
+        }
+
+# File-like reader over the ring buffer; keeps its position between reads
+class BufferStream:
+    def __init__(self, buffer, position, sample_width):
+        self.buffer = buffer
+        self.position = position
+        self.sample_width = sample_width
+
+    def read(self, size):
+        samples, self.position = self.buffer.read(self.position, size)
+        return samples.tobytes()
+
+    # Seconds between the newest captured audio and this reader's position
+    def lag(self):
+        return max(0, self.buffer.written - self.position) / self.buffer.sample_rate
+
+    def close(self):
+        pass
+
+# An sr.AudioSource backed by the capture buffer, so Recognizer.listen() can
+# be called in a loop without ever re-opening the microphone or losing audio
+class BufferedSource(sr.AudioSource):
+    def __init__(self, capture):
+        self.capture = capture
+        self.SAMPLE_RATE = capture.sample_rate
+        self.SAMPLE_WIDTH = 2
+        self.CHUNK = capture.chunk_size
+        self.stream = BufferStream(capture.buffer, capture.buffer.written, self.SAMPLE_WIDTH)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
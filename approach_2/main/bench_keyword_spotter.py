@@ -0,0 +1,68 @@
+# Accuracy and latency of KeywordSpotter on recorded WAV fixtures
+#
+#   python bench_keyword_spotter.py FIXTURE_DIR [--examples N] [--threshold T]
+#
+# FIXTURE_DIR holds 16-bit mono 16 kHz recordings:
+#   positive/*.wav   phrases containing the wake word
+#   negative/*.wav   anything else said near the kiosk
+# The first N positives (sorted by name) are used as examples, the rest are
+# scored together with the negatives. "Cloud calls avoided" is the share of
+# negatives the spotter keeps away from recognize_google.
+import os
+import sys
+import time
+import argparse
+import tempfile
+from metrics import percentile
+from keyword_spotter import KeywordSpotter, read_wav, write_wav
+
+def load_dir(path):
+    names = sorted(name for name in os.listdir(path) if name.endswith('.wav'))
+    return [(name, read_wav(os.path.join(path, name))) for name in names]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('fixtures')
+    parser.add_argument('--examples', type=int, default=3)
+    parser.add_argument('--threshold', type=float, default=None)
+    args = parser.parse_args()
+
+    positives = load_dir(os.path.join(args.fixtures, 'positive'))
+    negatives = load_dir(os.path.join(args.fixtures, 'negative'))
+    if len(positives) <= args.examples:
+        sys.exit(f"Need more than {args.examples} positive fixtures, found {len(positives)}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        word_dir = os.path.join(directory, 'bench')
+        os.makedirs(word_dir)
+        for name, samples in positives[:args.examples]:
+            write_wav(os.path.join(word_dir, name), samples)
+        spotter = KeywordSpotter(directory=directory, threshold=args.threshold)
+        spotter.configure('bench')
+
+        timings = []
+        def run(fixtures):
+            matched = 0
+            for name, samples in fixtures:
+                started = time.perf_counter()
+                if spotter.might_match(samples, 'bench'):
+                    matched += 1
+                timings.append((time.perf_counter() - started) * 1000)
+            return matched
+
+        held_out = positives[args.examples:]
+        detected = run(held_out)
+        false_accepts = run(negatives)
+
+    audio_seconds = sum(len(s) for _, s in held_out + negatives) / 16000
+    timings.sort()
+    print(f"examples {args.examples}  threshold {spotter.threshold:.3f}")
+    print(f"recall          {detected}/{len(held_out)} ({detected / len(held_out):.1%})")
+    if negatives:
+        print(f"false accepts   {false_accepts}/{len(negatives)} ({false_accepts / len(negatives):.1%})")
+        print(f"cloud calls avoided on negatives: {1 - false_accepts / len(negatives):.1%}")
+    print(f"latency per phrase  p50 {percentile(timings, 50):.2f} ms  p95 {percentile(timings, 95):.2f} ms  "
+          f"real-time factor {sum(timings) / 1000 / audio_seconds:.4f}")
+
+if __name__ == '__main__':
+    main()
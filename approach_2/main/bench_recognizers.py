@@ -0,0 +1,112 @@
+# Compare speech backends on recorded WAV fixtures
+#
+#   python bench_recognizers.py FIXTURE_DIR [--backends google,vosk,whisper]
+#
+# FIXTURE_DIR holds 16-bit mono 16 kHz recordings, each with a reference
+# transcript next to it (hello.wav + hello.txt). Every file is replayed
+# through the same Endpointer + listen_for_phrase() path listen_loop uses, and for each
+# backend this reports the real-time factor, the latency from the end of
+# the phrase to the final transcript, the time to the first partial result
+# and the word error rate.
+import os
+import sys
+import time
+import argparse
+import speech_recognition as sr
+from metrics import percentile
+from keyword_spotter import normalize_words
+from recognizers import make_backend, listen_for_phrase, BACKENDS
+from vad import Endpointer
+
+ENERGY_THRESHOLD = 300
+
+def word_edits(reference, hypothesis):
+    ref = normalize_words(reference).split()
+    hyp = normalize_words(hypothesis).split()
+    previous = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        current = [i]
+        for j, hyp_word in enumerate(hyp, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref_word != hyp_word)))
+        previous = current
+    return previous[-1], len(ref)
+
+def load_fixtures(directory):
+    fixtures = []
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.wav'):
+            continue
+        reference_path = os.path.join(directory, name[:-4] + '.txt')
+        if not os.path.exists(reference_path):
+            print(f"skipping {name}: no {name[:-4]}.txt reference")
+            continue
+        with open(reference_path) as f:
+            fixtures.append((os.path.join(directory, name), f.read().strip()))
+    return fixtures
+
+def run_backend(backend, fixtures):
+    endpointer = Endpointer()
+    audio_seconds = processing_seconds = 0.0
+    latencies, first_partials = [], []
+    edits = words = failures = silent = 0
+
+    for path, reference in fixtures:
+        partial_at = []
+        hypotheses = []
+        phrases = 0
+        started = time.perf_counter()
+        with sr.AudioFile(path) as source:
+            # Every phrase in the file, scored together against the whole reference
+            while True:
+                try:
+                    chunks = endpointer.listen(source.stream, ENERGY_THRESHOLD)
+                    phrase = listen_for_phrase(chunks, backend, on_partial=lambda text: partial_at.append(time.perf_counter()))
+                except sr.WaitTimeoutError:
+                    break  # no further phrase before the end of the file
+                phrases += 1
+                ended = time.perf_counter()
+                try:
+                    hypotheses.append(phrase.transcribe())
+                except (sr.UnknownValueError, sr.RequestError):
+                    failures += 1
+                latencies.append((time.perf_counter() - ended) * 1000)
+                audio_seconds += phrase.duration
+        processing_seconds += time.perf_counter() - started
+
+        if not phrases:
+            silent += 1  # too quiet for the endpointer; scored as an empty transcript
+            print(f"{backend.name:>8}  {os.path.basename(path)}: no phrase detected")
+        if partial_at:
+            first_partials.append((partial_at[0] - started) * 1000)
+        hypothesis = ' '.join(hypotheses)
+        e, n = word_edits(reference, hypothesis)
+        edits += e
+        words += n
+
+    latencies.sort()
+    first_partials.sort()
+    print(f"{backend.name:>8}  files {len(fixtures)}  phrases {len(latencies)}  failed {failures}  silent {silent}  "
+          f"RTF {processing_seconds / max(audio_seconds, 1e-9):.3f}  "
+          f"final latency {f'p50 {percentile(latencies, 50):.0f} ms  p95 {percentile(latencies, 95):.0f} ms' if latencies else 'n/a'}  "
+          f"first partial p50 {f'{percentile(first_partials, 50):.0f} ms' if first_partials else 'n/a'}  "
+          f"WER {edits / max(words, 1):.1%}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('fixtures')
+    parser.add_argument('--backends', default=','.join(sorted(BACKENDS)))
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        sys.exit("No fixtures with reference transcripts found")
+    for name in args.backends.split(','):
+        try:
+            backend = make_backend(name)
+        except Exception as e:  # missing optional package or model
+            print(f"{name:>8}  unavailable: {e}")
+            continue
+        run_backend(backend, fixtures)
+
+if __name__ == '__main__':
+    main()
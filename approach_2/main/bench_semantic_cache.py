@@ -0,0 +1,51 @@
+# Lookup latency of SemanticCache at different sizes
+#
+#   python bench_semantic_cache.py [sizes...]     (default: 10000 100000)
+#
+# Fills a cache with synthetic prompts, then times lookups for a mix of
+# near-duplicates (which should hit) and unseen prompts (which should miss).
+import sys
+import time
+import random
+from metrics import percentile
+from semantic_cache import SemanticCache
+
+WORDS = ('weather', 'music', 'robot', 'python', 'sensor', 'planet', 'coffee', 'garden', 'library', 'battery',
+         'camera', 'ocean', 'history', 'language', 'engine', 'window', 'market', 'science', 'festival', 'kiosk')
+TEMPLATES = ('what is a {} {} {}', 'tell me about the {} and the {} {}', 'how does a {} {} {} work',
+             'who invented the {} {} {}', 'can you explain {} with {} {}')
+UNSEEN_TEMPLATES = ('please summarise {} for a {} {} audience', 'write a poem on {} {} and {}')
+LOOKUPS = 500
+
+def make_prompt(rng, templates=TEMPLATES):
+    return rng.choice(templates).format(rng.choice(WORDS), rng.choice(WORDS), rng.choice(WORDS))
+
+def run(size, rng):
+    cache = SemanticCache(max_entries=size)
+    prompts = [make_prompt(rng) for _ in range(size)]
+    started = time.perf_counter()
+    for prompt in prompts:
+        cache.add(prompt, 'Default', 'bench', 'answer')
+    fill_time = time.perf_counter() - started
+
+    queries = []
+    for _ in range(LOOKUPS // 2):
+        queries.append(rng.choice(prompts).replace('what is', "what's") + '?')  # near-duplicate
+        queries.append(make_prompt(rng, UNSEEN_TEMPLATES))                       # unseen
+    timings = []
+    for query in queries:
+        started = time.perf_counter()
+        cache.lookup(query, 'Default', 'bench')
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+
+    stats = cache.stats()
+    print(f"{size:>8} entries  fill {fill_time:6.2f}s  "
+          f"lookup p50 {percentile(timings, 50):6.3f} ms  p95 {percentile(timings, 95):6.3f} ms  "
+          f"max {timings[-1]:6.3f} ms  hit rate {stats['hit_rate']}")
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000]
+    rng = random.Random(42)
+    for size in sizes:
+        run(size, rng)
@@ -0,0 +1,189 @@
+# Conversation context for the LLM prompt
+#
+# ai_process_tokens used to send only the current utterance, so "and what
+# about tomorrow?" meant nothing to the model and people repeated whole
+# questions. Each session (the voice loop, or a dashboard tab) now keeps its
+# recent turns in memory and the prompt carries as many of the latest ones
+# as fit in a token budget. Turns are counted once when they are added and the
+# session keeps a running total, so building a prompt never re-counts or
+# re-reads chat_history. Turns that fall out of the budget are folded into
+# a running summary by a background thread, which the prompt carries in
+# place of them.
+import re
+import time
+import queue
+import logging
+import threading
+from collections import deque
+from metrics import RollingStats
+
+TOKEN_BUDGET = 1024          # history tokens per prompt, summary included
+MAX_TURNS = 20               # kept in full per session, whatever their size
+SESSION_IDLE_SECONDS = 10 * 60  # a session quiet for this long starts over
+SUMMARY_MAX_TOKENS = 200     # a longer summary is cut to this
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+_encoding = None
+
+# tiktoken's count when it is installed, otherwise words and punctuation,
+# which is within ~20% of it for English chat
+def count_tokens(text):
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken  # optional dependency, only used for exact counts
+            _encoding = tiktoken.get_encoding('cl100k_base')
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text))
+    return len(TOKEN_PATTERN.findall(text))
+
+def truncate_tokens(text, limit):
+    words = text.split()
+    while len(words) > 1 and count_tokens(' '.join(words)) > limit:
+        words = words[:len(words) * 9 // 10]
+    return ' '.join(words)
+
+class Turn:
+    __slots__ = ('user', 'assistant', 'tokens')
+
+    def __init__(self, user, assistant):
+        self.user = user
+        self.assistant = assistant
+        self.tokens = count_tokens(user) + count_tokens(assistant)
+
+class Session:
+    def __init__(self):
+        self.turns = deque()
+        self.tokens = 0            # sum of turn tokens, kept up to date on every change
+        self.summary = ''
+        self.summary_tokens = 0
+        self.unsummarized = []     # turns out of the budget, waiting for the summarizer
+        self.generation = 0        # bumped by reset so a late summary is thrown away
+        self.last_used = time.time()
+
+class ConversationContext:
+    # summarize(previous_summary, turns) returns a new summary string; it is
+    # called on a background thread and may be slow
+    def __init__(self, summarize=None, token_budget=TOKEN_BUDGET, max_turns=MAX_TURNS,
+                 idle_seconds=SESSION_IDLE_SECONDS):
+        self.summarize = summarize
+        self.token_budget = token_budget
+        self.max_turns = max_turns
+        self.idle_seconds = idle_seconds
+        self.sessions = {}
+        self.summaries = 0
+        self.summary_failures = 0
+        self.summary_latency = RollingStats()
+        self.prompt_tokens = RollingStats()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def _session(self, session_id):
+        now = time.time()
+        session = self.sessions.get(session_id)
+        if session is None or now - session.last_used > self.idle_seconds:
+            # Forget every idle session while we're at it, so tabs that went away don't pile up
+            for idle_id in [i for i, s in self.sessions.items() if now - s.last_used > self.idle_seconds]:
+                self.sessions.pop(idle_id).generation += 1
+            session = self.sessions[session_id] = Session()
+        session.last_used = now
+        return session
+
+    # Messages for the model: system prompt (plus the summary, if any), the
+    # turns that fit in the budget, then the new user text. More than two
+    # messages means the reply can depend on earlier turns.
+    def messages(self, session_id, system_prompt, text):
+        with self._lock:
+            session = self._session(session_id)
+            summary = session.summary
+            turns = list(session.turns)
+            tokens = session.tokens + session.summary_tokens
+        if summary:
+            system_prompt += f"\nSummary of the conversation so far: {summary}"
+        messages = [{"role": "system", "content": system_prompt}]
+        for turn in turns:
+            messages.append({"role": "user", "content": turn.user})
+            messages.append({"role": "assistant", "content": turn.assistant})
+        messages.append({"role": "user", "content": text})
+        self.prompt_tokens.record(tokens)
+        return messages
+
+    def add(self, session_id, user, assistant):
+        if not user or not assistant:
+            return
+        turn = Turn(user, assistant)
+        with self._lock:
+            session = self._session(session_id)
+            session.turns.append(turn)
+            session.tokens += turn.tokens
+            evicted = []
+            # Oldest turns leave first; the newest one always stays, even if it alone is over budget
+            while len(session.turns) > 1 and (
+                    session.tokens + session.summary_tokens > self.token_budget or len(session.turns) > self.max_turns):
+                old = session.turns.popleft()
+                session.tokens -= old.tokens
+                evicted.append(old)
+            if not evicted or self.summarize is None:
+                return
+            session.unsummarized.extend(evicted)
+        self._start()
+        self._queue.put(session_id)
+
+    def reset(self, session_id):
+        with self._lock:
+            session = self.sessions.pop(session_id, None)
+            if session is not None:
+                session.generation += 1
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='conversation-summarizer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            session_id = self._queue.get()
+            with self._lock:
+                session = self.sessions.get(session_id)
+                if session is None or not session.unsummarized:
+                    continue
+                turns, session.unsummarized = session.unsummarized, []
+                previous, generation = session.summary, session.generation
+            started = time.time()
+            try:
+                summary = truncate_tokens(self.summarize(previous, turns).strip(), SUMMARY_MAX_TOKENS)
+            except Exception as e:
+                # The turns are lost from context either way; don't retry into a failing model
+                self.summary_failures += 1
+                logging.error(f"Error summarizing conversation: {e}")
+                continue
+            self.summary_latency.record(time.time() - started)
+            self.summaries += 1
+            with self._lock:
+                if self.sessions.get(session_id) is session and session.generation == generation:
+                    session.summary = summary
+                    session.summary_tokens = count_tokens(summary)
+
+    def stats(self):
+        with self._lock:
+            sessions = {
+                session_id: {
+                    'turns': len(session.turns),
+                    'tokens': session.tokens,
+                    'summary_tokens': session.summary_tokens
+                }
+                for session_id, session in self.sessions.items()
+            }
+        return {
+            'token_budget': self.token_budget,
+            'sessions': sessions,
+            'prompt_tokens': self.prompt_tokens.summary(1),
+            'summaries': self.summaries,
+            'summary_failures': self.summary_failures,
+            'summary_latency': self.summary_latency.summary(),
+            'pending_summaries': self._queue.qsize()
+        }
@@ -0,0 +1,56 @@
+# In-process publish/subscribe used to push state changes to dashboards
+#
+# Publishers call publish() once per change and every subscriber gets its own
+# bounded queue, so N open dashboards cost one fan-out per change instead of
+# N clients re-querying the database every couple of seconds.
+import json
+import queue
+import threading
+
+SUBSCRIBER_QUEUE_SIZE = 256
+
+class EventBus:
+    def __init__(self, queue_size=SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def publish(self, topic, data=None):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait((topic, data))
+            except queue.Full:
+                # A subscriber that can't keep up has already missed deltas;
+                # drop its backlog and tell it to re-read the full state
+                self._reset(q)
+
+    def _reset(self, q):
+        try:
+            while True:
+                q.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            q.put_nowait(('resync', None))
+        except queue.Full:
+            pass
+
+# Encode one event in the text/event-stream wire format
+def format_sse(topic, data):
+    return f"event: {topic}\ndata: {json.dumps(data)}\n\n"
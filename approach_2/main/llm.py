@@ -0,0 +1,294 @@
+# LLM providers behind one streaming interface
+#
+# stream_completion used to call g4f.ChatCompletion.create with a fixed
+# model, and whichever provider g4f picked could take 300 ms or 30 s to
+# start answering. Requests now go through an LLMRouter over a list of
+# providers, configured with LLM_PROVIDERS:
+#
+#   g4f:gpt-4o              g4f with a model, letting g4f choose the provider
+#   g4f:gpt-4o@Blackbox     g4f with a model and a named g4f provider
+#   stub                    deterministic local replies, no network
+#   stub:0.05               the same, one word every 50 ms
+#
+# The router tracks time to first token per provider and sends each request
+# to the healthy provider that has been fastest lately. If that one hasn't
+# produced a token by its own p95, the request is hedged: the next provider
+# starts too, whichever answers first is streamed and the other is dropped.
+# A provider that fails FAILURE_THRESHOLD times in a row is skipped for
+# COOLDOWN seconds.
+import time
+import queue
+import random
+import logging
+import threading
+from metrics import RollingStats
+
+HEDGE_DELAY = 2.0            # seconds before hedging, until a provider has MIN_SAMPLES timings
+MIN_HEDGE_DELAY = 0.05       # never hedge sooner than this
+MIN_SAMPLES = 5
+MAX_ATTEMPTS = 2             # providers racing on one request
+EXPLORE = 0.05               # share of requests sent to another provider to keep its timings fresh
+FAILURE_THRESHOLD = 3
+COOLDOWN = 30.0
+STUB_REPLY = "This is a local stub reply. It streams one word at a time so the server can be timed without a real model."
+
+class LLMError(Exception):
+    pass
+
+class G4FProvider:
+    def __init__(self, model, provider=None, **options):
+        self.name = f'g4f:{model}' + (f'@{provider}' if provider else '')
+        self.model = model
+        self.provider = provider
+        self.options = options
+
+    def stream(self, messages):
+        import g4f  # imported on first use so the stub runs without it
+        kwargs = dict(self.options)
+        if self.provider:
+            kwargs['provider'] = getattr(g4f.Provider, self.provider)
+        response = g4f.ChatCompletion.create(model=self.model, messages=messages, stream=True, **kwargs)
+        for chunk in response:
+            # Some providers hand back OpenAI-style delta dicts instead of plain strings
+            if isinstance(chunk, dict):
+                chunk = chunk['choices'][0].get('delta', {}).get('content') or ''
+            if chunk:
+                yield chunk
+
+# Same words in the same order every time, for tests and benchmarks
+class StubProvider:
+    def __init__(self, delay=0.0, reply=STUB_REPLY, name='stub'):
+        self.name = name
+        self.delay = delay
+        self.reply = reply
+
+    def stream(self, messages):
+        for word in self.reply.split(' '):
+            if self.delay:
+                time.sleep(self.delay)
+            yield word + ' '
+
+# Providers from an LLM_PROVIDERS string, e.g. "g4f:gpt-4o,g4f:gpt-4o@Blackbox,stub:0.05"
+def make_providers(spec, **options):
+    providers = []
+    for entry in spec.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        kind, _, arg = entry.partition(':')
+        if kind == 'stub':
+            providers.append(StubProvider(float(arg or 0), name=entry))
+        elif kind == 'g4f' and arg:
+            model, _, provider = arg.partition('@')
+            providers.append(G4FProvider(model, provider or None, **options))
+        else:
+            raise ValueError(f"Unknown LLM provider '{entry}', expected g4f:MODEL[@PROVIDER] or stub[:DELAY]")
+    if not providers:
+        raise ValueError("LLM_PROVIDERS is empty")
+    return providers
+
+class _Health:
+    def __init__(self):
+        self.ttft = RollingStats(100)   # seconds to first token
+        self.lost_hedge_wait = RollingStats(100)  # seconds a losing hedge had waited: a lower bound, kept out of ttft
+        self.requests = 0
+        self.wins = 0                   # requests this provider ended up answering
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.down_until = 0.0
+
+# One provider's run for one request; reports (attempt, kind, value) on the
+# request's queue, kind being 'token', 'done' or 'error'
+class _Attempt:
+    def __init__(self, router, provider, messages, events, timed=True):
+        self.router = router
+        self.provider = provider
+        self.messages = messages
+        self.events = events
+        self.timed = timed  # counts towards the provider's time to first token
+        self.started = time.time()
+        self.first_token_at = None
+        self.cancelled = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, name=f'llm-{self.provider.name}', daemon=True).start()
+
+    def _run(self):
+        stream = self.provider.stream(self.messages)
+        try:
+            for chunk in stream:
+                if self.cancelled.is_set():
+                    return
+                if self.first_token_at is None:
+                    self.first_token_at = time.time()
+                    if self.timed:
+                        self.router._first_token(self.provider, self.first_token_at - self.started)
+                self.events.put((self, 'token', chunk))
+        except Exception as e:
+            # Once cancelled nobody was waiting on it, so a late failure says nothing about health
+            if not self.cancelled.is_set():
+                self.router._failure(self.provider, e)
+            self.events.put((self, 'error', e))
+            return
+        finally:
+            stream.close()
+        if not self.cancelled.is_set():
+            self.router._success(self.provider)
+        self.events.put((self, 'done', None))
+
+    # A hedge that lost only shows the provider was at least this slow; that
+    # is kept apart from its time to first token so its ranking isn't flattered
+    def cancel(self):
+        if self.cancelled.is_set():
+            return
+        self.cancelled.set()
+        if self.timed and self.first_token_at is None:
+            self.router._lost_hedge(self.provider, time.time() - self.started)
+
+class LLMRouter:
+    def __init__(self, providers, hedge=True, max_attempts=MAX_ATTEMPTS, explore=EXPLORE):
+        self.providers = list(providers)
+        self.hedge = hedge
+        self.max_attempts = max_attempts
+        self.explore = explore
+        self.hedged = 0          # requests where a second provider was started
+        self.hedge_wins = 0      # ... and it answered first
+        self.failovers = 0       # a provider failed before its first token and another took over
+        self._health = {provider.name: _Health() for provider in self.providers}
+        self._lock = threading.Lock()
+
+    # Healthy providers, fastest first. Unmeasured ones sort first so each gets
+    # tried, but one that has only ever lost hedges sorts by how long it kept
+    # the request waiting; if every provider is cooling down, try them all anyway.
+    def ranked(self, explore=True):
+        now = time.time()
+        with self._lock:
+            healthy = [p for p in self.providers if self._health[p.name].down_until <= now]
+            candidates = healthy or list(self.providers)
+            ordered = sorted(candidates, key=lambda p: self._latency(self._health[p.name]))
+        if explore and len(ordered) > 1 and random.random() < self.explore:
+            ordered.insert(0, ordered.pop(random.randrange(1, len(ordered))))
+        return ordered
+
+    @staticmethod
+    def _latency(health):
+        return health.ttft.summary()['p50'] or health.lost_hedge_wait.summary()['p50'] or 0.0
+
+    def hedge_delay(self, provider):
+        summary = self._health[provider.name].ttft.summary()
+        if summary['count'] < MIN_SAMPLES:
+            return HEDGE_DELAY
+        return max(MIN_HEDGE_DELAY, summary['p95'])
+
+    # Yield the reply's chunks from whichever provider starts answering first.
+    # A provider that fails before its first token is replaced by the next one;
+    # a failure after that is raised, since the reply can't switch mid-sentence.
+    # background requests (e.g. conversation summaries) aren't hedged and their
+    # long prompts don't count towards the latency that ranks providers.
+    def stream(self, messages, background=False):
+        candidates = self.ranked()
+        events = queue.Queue()
+        attempts = []
+        running = set()
+        winner = None
+        hedge_at = None
+
+        def launch():
+            nonlocal hedge_at
+            provider = candidates.pop(0)
+            with self._lock:
+                self._health[provider.name].requests += 1
+            attempt = _Attempt(self, provider, messages, events, timed=not background)
+            attempts.append(attempt)
+            running.add(attempt)
+            attempt.start()
+            hedge_at = time.time() + self.hedge_delay(provider)
+
+        launch()
+        try:
+            while True:
+                timeout = None
+                if winner is None and self.hedge and not background and candidates and len(attempts) < self.max_attempts:
+                    timeout = max(0.0, hedge_at - time.time())
+                try:
+                    attempt, kind, value = events.get(timeout=timeout)
+                except queue.Empty:
+                    self.hedged += 1
+                    launch()
+                    continue
+
+                if winner is None:
+                    if kind == 'error':
+                        running.discard(attempt)
+                        if running:
+                            continue
+                        if not candidates:
+                            raise LLMError(f"{attempt.provider.name} failed: {value}")
+                        self.failovers += 1
+                        logging.warning(f"LLM provider {attempt.provider.name} failed, trying {candidates[0].name}: {value}")
+                        launch()
+                        continue
+                    winner = attempt
+                    with self._lock:
+                        self._health[winner.provider.name].wins += 1
+                    if winner is not attempts[0]:
+                        self.hedge_wins += 1
+                    for other in running:
+                        if other is not winner:
+                            other.cancel()
+
+                if attempt is not winner:
+                    continue
+                if kind == 'token':
+                    yield value
+                elif kind == 'done':
+                    return
+                else:
+                    raise LLMError(f"{winner.provider.name} failed mid-reply: {value}")
+        finally:
+            # Also reached when the caller stops reading early
+            for attempt in attempts:
+                attempt.cancelled.set()
+
+    def _first_token(self, provider, seconds):
+        self._health[provider.name].ttft.record(seconds)
+
+    def _lost_hedge(self, provider, seconds):
+        self._health[provider.name].lost_hedge_wait.record(seconds)
+
+    def _success(self, provider):
+        with self._lock:
+            self._health[provider.name].consecutive_failures = 0
+
+    def _failure(self, provider, error):
+        with self._lock:
+            health = self._health[provider.name]
+            health.failures += 1
+            health.consecutive_failures += 1
+            if health.consecutive_failures >= FAILURE_THRESHOLD:
+                if health.down_until <= time.time():
+                    logging.warning(f"LLM provider {provider.name} failed {health.consecutive_failures} times in a row, "
+                                    f"skipping it for {COOLDOWN:.0f} s")
+                health.down_until = time.time() + COOLDOWN
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            providers = {
+                name: {
+                    'healthy': health.down_until <= now,
+                    'requests': health.requests,
+                    'wins': health.wins,
+                    'failures': health.failures,
+                    'time_to_first_token': health.ttft.summary(),
+                    'lost_hedge_wait': health.lost_hedge_wait.summary()
+                }
+                for name, health in self._health.items()
+            }
+        return {
+            'providers': providers,
+            'order': [provider.name for provider in self.ranked(explore=False)],
+            'hedged': self.hedged,
+            'hedge_wins': self.hedge_wins,
+            'failovers': self.failovers
+        }
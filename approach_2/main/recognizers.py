@@ -0,0 +1,163 @@
+# Speech-to-text backends behind one interface
+#
+# listen_loop used to call recognize_google directly, so every turn paid a
+# network round trip and the loop could not run offline. A backend here
+# turns phrase audio into text; offline ones (Vosk, faster-whisper) run on
+# the CPU, and streaming ones report partial transcripts while the user is
+# still talking. Pick one with the SPEECH_BACKEND environment variable.
+#
+#   google   recognize_google (default, needs network)
+#   vosk     pip install vosk; unpack a model into VOSK_MODEL_PATH
+#   whisper  pip install faster-whisper; WHISPER_MODEL picks the model size
+import os
+import json
+import numpy as np
+import speech_recognition as sr
+
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+VOSK_MODEL_PATH = os.getenv('VOSK_MODEL_PATH', 'models/vosk')
+WHISPER_MODEL = os.getenv('WHISPER_MODEL', 'base.en')
+
+BACKENDS = {}
+
+def register(name):
+    def decorator(cls):
+        cls.name = name
+        BACKENDS[name] = cls
+        return cls
+    return decorator
+
+def make_backend(name=None, **kwargs):
+    name = name or os.getenv('SPEECH_BACKEND', 'google')
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown speech backend '{name}', expected one of {sorted(BACKENDS)}")
+    return BACKENDS[name](**kwargs)
+
+# Collects a phrase and transcribes it in one go when it ends
+class BufferedSession:
+    def __init__(self, backend):
+        self.backend = backend
+        self.chunks = []
+
+    # Returns the partial transcript so far, or None if the backend has none
+    def feed(self, data):
+        self.chunks.append(data)
+        return None
+
+    def finish(self):
+        audio = sr.AudioData(b''.join(self.chunks), SAMPLE_RATE, SAMPLE_WIDTH)
+        return self.backend.transcribe(audio)
+
+class SpeechBackend:
+    name = None
+    remote = False   # True if transcribing costs a network call (worth gating with the wake-word spotter)
+
+    def start(self):
+        return BufferedSession(self)
+
+    # Text for a complete sr.AudioData; raises sr.UnknownValueError if nothing was understood
+    def transcribe(self, audio):
+        raise NotImplementedError
+
+@register('google')
+class GoogleBackend(SpeechBackend):
+    remote = True
+
+    def __init__(self, language='en-US'):
+        self.language = language
+        self.recognizer = sr.Recognizer()
+
+    def transcribe(self, audio):
+        return self.recognizer.recognize_google(audio, language=self.language)
+
+@register('vosk')
+class VoskBackend(SpeechBackend):
+    def __init__(self, model_path=VOSK_MODEL_PATH):
+        import vosk  # optional dependency, only needed for this backend
+        vosk.SetLogLevel(-1)
+        self.vosk = vosk
+        self.model = vosk.Model(model_path)
+
+    def start(self):
+        return VoskSession(self)
+
+    def transcribe(self, audio):
+        session = self.start()
+        session.feed(audio.get_raw_data(convert_rate=SAMPLE_RATE, convert_width=SAMPLE_WIDTH))
+        return session.finish()
+
+# Vosk decodes incrementally, so partial results are free
+class VoskSession:
+    def __init__(self, backend):
+        self.recognizer = backend.vosk.KaldiRecognizer(backend.model, SAMPLE_RATE)
+        self.segments = []
+
+    def feed(self, data):
+        if self.recognizer.AcceptWaveform(data):
+            self._add(json.loads(self.recognizer.Result()).get('text', ''))
+            return ' '.join(self.segments) or None
+        partial = json.loads(self.recognizer.PartialResult()).get('partial', '')
+        return ' '.join(self.segments + [partial]).strip() or None
+
+    def finish(self):
+        self._add(json.loads(self.recognizer.FinalResult()).get('text', ''))
+        text = ' '.join(self.segments)
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+    def _add(self, text):
+        if text:
+            self.segments.append(text)
+
+@register('whisper')
+class WhisperBackend(SpeechBackend):
+    def __init__(self, model_size=WHISPER_MODEL):
+        from faster_whisper import WhisperModel  # optional dependency, only needed for this backend
+        self.model = WhisperModel(model_size, device='cpu', compute_type='int8')
+
+    def transcribe(self, audio):
+        raw = audio.get_raw_data(convert_rate=SAMPLE_RATE, convert_width=SAMPLE_WIDTH)
+        samples = np.frombuffer(raw, dtype=np.int16).astype(np.float32) / 32768.0
+        segments, _ = self.model.transcribe(samples, language='en', beam_size=1)
+        text = ' '.join(segment.text.strip() for segment in segments).strip()
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+# One phrase captured by listen_for_phrase; transcribe() finishes recognition
+class Phrase:
+    def __init__(self, session, chunks):
+        self.session = session
+        self.chunks = chunks
+
+    @property
+    def audio(self):
+        return sr.AudioData(b''.join(self.chunks), SAMPLE_RATE, SAMPLE_WIDTH)
+
+    @property
+    def samples(self):
+        return np.frombuffer(b''.join(self.chunks), dtype=np.int16)
+
+    @property
+    def duration(self):
+        return sum(len(chunk) for chunk in self.chunks) / (SAMPLE_RATE * SAMPLE_WIDTH)
+
+    def transcribe(self):
+        return self.session.finish()
+
+# Feed one phrase to backend as it is spoken. chunks yields raw 16 kHz 16-bit
+# audio, e.g. Endpointer.listen(); on_partial(text) is called whenever the
+# partial transcript changes.
+def listen_for_phrase(chunks, backend, on_partial=None):
+    session = backend.start()
+    received = []
+    last_partial = None
+    for data in chunks:
+        received.append(data)
+        partial = session.feed(data)
+        if partial and partial != last_partial and on_partial is not None:
+            on_partial(partial)
+        last_partial = partial or last_partial
+    return Phrase(session, received)
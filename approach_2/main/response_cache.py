@@ -0,0 +1,113 @@
+# Cache of LLM replies for prompts that repeat
+#
+# Kiosk traffic asks the same handful of questions over and over. Replies are
+# keyed by the normalized prompt plus the personality and model that produced
+# them, kept in a small in-memory LRU and, when a store is given, in the
+# response_cache table so they survive restarts. Every entry expires after
+# its TTL, and prompts that ask for real-time information are never cached.
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+DEFAULT_TTL = 24 * 60 * 60   # seconds a cached reply stays valid
+MEMORY_ENTRIES = 256         # replies kept in the in-memory tier
+
+# Prompts mentioning any of these want a fresh answer, not yesterday's
+REAL_TIME_KEYWORDS = ('weather', 'news', 'latest', 'current', 'today', 'update')
+
+PUNCTUATION = re.compile(r"[^\w\s']")
+WHITESPACE = re.compile(r'\s+')
+
+def is_real_time(text):
+    lowered = text.lower()
+    return any(keyword in lowered for keyword in REAL_TIME_KEYWORDS)
+
+# "What can you do?" and "what can you do" should share an entry
+def normalize(text):
+    text = PUNCTUATION.sub(' ', text.lower())
+    return WHITESPACE.sub(' ', text).strip()
+
+def make_key(text, personality, model):
+    raw = f"{model}\x00{personality}\x00{normalize(text)}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+class ResponseCache:
+    # store is the db module (or anything with execute/fetchone); None keeps
+    # the cache in memory only
+    def __init__(self, store=None, ttl=DEFAULT_TTL, max_entries=MEMORY_ENTRIES):
+        self.store = store
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (response, expires_at), least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                response, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.memory_hits += 1
+                    return response
+                del self._entries[key]
+
+        row = None
+        if self.store is not None:
+            row = self.store.fetchone(
+                'SELECT response, expires_at FROM response_cache WHERE key = ? AND expires_at > ?',
+                (key, now)
+            )
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.store_hits += 1
+            self._remember(key, row[0], row[1])
+        return row[0]
+
+    def put(self, key, response, ttl=None):
+        if not response:
+            return
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._remember(key, response, expires_at)
+        if self.store is not None:
+            self.store.execute(
+                'INSERT OR REPLACE INTO response_cache (key, response, expires_at) VALUES (?, ?, ?)',
+                (key, response, expires_at)
+            )
+
+    def _remember(self, key, response, expires_at):
+        self._entries[key] = (response, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    # Drop expired rows so the table doesn't grow without bound
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            for key in [k for k, (_, expires_at) in self._entries.items() if expires_at <= now]:
+                del self._entries[key]
+        if self.store is not None:
+            self.store.execute('DELETE FROM response_cache WHERE expires_at <= ?', (now,))
+
+    def stats(self):
+        with self._lock:
+            hits = self.memory_hits + self.store_hits
+            lookups = hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': hits,
+                'memory_hits': self.memory_hits,
+                'store_hits': self.store_hits,
+                'misses': self.misses,
+                'hit_rate': round(hits / lookups, 4) if lookups else None
+            }
@@ -0,0 +1,103 @@
+# Background sampler for CPU, memory and temperature readings
+#
+# psutil.cpu_percent(interval=1) blocks the caller for a full second, which is
+# far too slow for a status endpoint. The sampler does the waiting on its own
+# thread and keeps a ring buffer of recent samples, so readers get the latest
+# values (and min/avg/max over a window) without blocking.
+import threading
+import time
+import logging
+from collections import deque
+import psutil
+
+SAMPLE_INTERVAL = 1.0   # seconds between samples
+HISTORY_SIZE = 900      # 15 minutes at the default interval
+DEFAULT_WINDOWS = (10, 60, 300)
+
+METRICS = ('cpu_usage', 'memory_usage', 'cpu_temp')
+
+def read_cpu_temp():
+    try:
+        temp = psutil.sensors_temperatures()
+        for name in temp:
+            if 'cpu' in name.lower():
+                return temp[name][0].current
+    except (AttributeError, NotImplementedError):
+        pass
+    return None
+
+def take_sample():
+    # cpu_percent(interval=None) compares against the previous call, so it
+    # never blocks; the sampler thread provides the spacing between calls
+    return {
+        'timestamp': time.time(),
+        'cpu_usage': psutil.cpu_percent(interval=None),
+        'memory_usage': psutil.virtual_memory().percent,
+        'cpu_temp': read_cpu_temp()
+    }
+
+class StatsSampler:
+    def __init__(self, interval=SAMPLE_INTERVAL, history_size=HISTORY_SIZE, on_sample=None):
+        self.interval = interval
+        self.on_sample = on_sample  # optional callback, run on the sampler thread
+        self.samples = deque(maxlen=history_size)
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name='stats-sampler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout=self.interval * 2)
+        self._thread = None
+
+    def _run(self):
+        psutil.cpu_percent(interval=None)  # prime the baseline for the first delta
+        while not self._stop_event.wait(self.interval):
+            sample = take_sample()
+            with self._lock:
+                self.samples.append(sample)
+            if self.on_sample is not None:
+                try:
+                    self.on_sample(sample)
+                except Exception as e:
+                    logging.error(f"Error in stats sampler callback: {e}")
+
+    def latest(self):
+        with self._lock:
+            if self.samples:
+                return dict(self.samples[-1])
+        # Nothing sampled yet (sampler just started): read once without blocking
+        return take_sample()
+
+    def summary(self, window):
+        cutoff = time.time() - window
+        with self._lock:
+            recent = [s for s in self.samples if s['timestamp'] >= cutoff]
+
+        result = {'samples': len(recent)}
+        for metric in METRICS:
+            values = [s[metric] for s in recent if s[metric] is not None]
+            if values:
+                result[metric] = {
+                    'min': min(values),
+                    'avg': round(sum(values) / len(values), 2),
+                    'max': max(values)
+                }
+            else:
+                result[metric] = None
+        return result
+
+    def snapshot(self, windows=DEFAULT_WINDOWS):
+        stats = self.latest()
+        stats['windows'] = {f'{w}s': self.summary(w) for w in windows}
+        return stats
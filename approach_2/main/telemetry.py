@@ -0,0 +1,242 @@
+# Rollups and retention for Pi telemetry
+#
+# pi_data gets a row per second forever and charting an hour of it meant
+# scanning 3600 rows. pi_data is now only the raw tier, trimmed to
+# RAW_RETENTION and indexed on timestamp. Every sample is also folded into
+# 1-minute and 1-hour buckets in pi_rollup (min/max/sum/count per metric, so
+# buckets can be merged when late samples arrive and averages stay exact),
+# and /api/pi_history reads only those buckets.
+#
+# Buckets are accumulated in memory and upserted every FLUSH_INTERVAL, so
+# the request path only does a dict update per sample.
+import time
+import logging
+import threading
+from datetime import datetime
+
+METRICS = ('cpu_usage', 'memory_usage', 'cpu_temp', 'sensor_distance')
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'   # what the Pi agent sends
+
+MINUTE = 60
+HOUR = 60 * 60
+DAY = 24 * HOUR
+TIERS = (MINUTE, HOUR)
+RAW_RETENTION = DAY
+RETENTION = {MINUTE: 30 * DAY, HOUR: 365 * DAY}
+
+FLUSH_INTERVAL = 10.0
+PURGE_INTERVAL = HOUR
+MAX_POINTS = 720                                          # per /api/pi_history response when no step is given
+DEFAULT_STEPS = (MINUTE, 5 * MINUTE, 15 * MINUTE, HOUR, 6 * HOUR, DAY)
+
+COLUMNS = [f'{metric}_{part}' for metric in METRICS for part in ('min', 'max', 'sum', 'count')]
+
+SCHEMA = [f'''
+    CREATE TABLE IF NOT EXISTS pi_rollup (
+        step INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,
+        {', '.join(f'{column} REAL' for column in COLUMNS)},
+        PRIMARY KEY (step, bucket)
+    ) WITHOUT ROWID
+''', 'CREATE INDEX IF NOT EXISTS idx_pi_data_timestamp ON pi_data (timestamp)']
+
+# Merge a bucket into the stored one; min()/max() with a NULL side would give NULL
+UPSERT = f'''
+    INSERT INTO pi_rollup (step, bucket, {', '.join(COLUMNS)})
+    VALUES ({', '.join('?' for _ in range(len(COLUMNS) + 2))})
+    ON CONFLICT (step, bucket) DO UPDATE SET
+''' + ',\n'.join(
+    f'{metric}_min = min(coalesce({metric}_min, excluded.{metric}_min), coalesce(excluded.{metric}_min, {metric}_min)), '
+    f'{metric}_max = max(coalesce({metric}_max, excluded.{metric}_max), coalesce(excluded.{metric}_max, {metric}_max)), '
+    f'{metric}_sum = {metric}_sum + excluded.{metric}_sum, '
+    f'{metric}_count = {metric}_count + excluded.{metric}_count'
+    for metric in METRICS
+)
+
+HISTORY = f'''
+    SELECT (bucket / ?) * ? AS t, {', '.join(
+        f'min({metric}_min), max({metric}_max), sum({metric}_sum), sum({metric}_count)' for metric in METRICS)}
+    FROM pi_rollup
+    WHERE step = ? AND bucket >= ? AND bucket < ?
+    GROUP BY t
+    ORDER BY t
+'''
+
+# Epoch seconds for a sample timestamp, or None if it can't be read
+def parse_timestamp(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return datetime.strptime(value, TIMESTAMP_FORMAT).timestamp()
+    except (TypeError, ValueError):
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+# /api/pi_history bounds: epoch seconds or a timestamp like the Pi sends
+def parse_time_arg(value):
+    try:
+        return float(value)
+    except ValueError:
+        epoch = parse_timestamp(value)
+        if epoch is None:
+            raise ValueError(f"Invalid time '{value}'")
+        return epoch
+
+def format_timestamp(epoch):
+    return datetime.fromtimestamp(epoch).strftime(TIMESTAMP_FORMAT)
+
+# Fold bucket b into bucket a, both [min, max, sum, count] * len(METRICS)
+def merge_buckets(a, b):
+    for j in range(0, len(a), 4):
+        if b[j + 3]:
+            a[j] = b[j] if a[j] is None else min(a[j], b[j])
+            a[j + 1] = b[j + 1] if a[j + 1] is None else max(a[j + 1], b[j + 1])
+            a[j + 2] += b[j + 2]
+            a[j + 3] += b[j + 3]
+
+# Step for a chart over span seconds: the finest that stays under MAX_POINTS
+def default_step(span):
+    for step in DEFAULT_STEPS:
+        if span / step <= MAX_POINTS:
+            return step
+    return DEFAULT_STEPS[-1]
+
+class TelemetryStore:
+    # store is the db module (executemany, fetchall and transaction are used)
+    def __init__(self, store, flush_interval=FLUSH_INTERVAL):
+        self.store = store
+        self.flush_interval = flush_interval
+        self.samples = 0
+        self.unparsed = 0
+        self.buckets_written = 0
+        self.raw_purged = 0
+        self.rollups_purged = 0
+        self.last_purge = None
+        self._buckets = {}  # (step, bucket) -> [min, max, sum, count] * len(METRICS)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._stop_event.clear()
+                self._thread = threading.Thread(target=self._run, name='telemetry', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout=self.flush_interval * 2)
+
+    # Fold samples (dicts with a timestamp and METRICS) into the open buckets
+    def add(self, samples):
+        with self._lock:
+            for sample in samples:
+                epoch = parse_timestamp(sample.get('timestamp'))
+                if epoch is None:
+                    self.unparsed += 1
+                    continue
+                self.samples += 1
+                for step in TIERS:
+                    key = (step, int(epoch // step) * step)
+                    values = self._buckets.get(key)
+                    if values is None:
+                        values = self._buckets[key] = [None, None, 0.0, 0] * len(METRICS)
+                    for i, metric in enumerate(METRICS):
+                        value = sample.get(metric)
+                        if value is None:
+                            continue
+                        j = i * 4
+                        values[j] = value if values[j] is None else min(values[j], value)
+                        values[j + 1] = value if values[j + 1] is None else max(values[j + 1], value)
+                        values[j + 2] += value
+                        values[j + 3] += 1
+
+    # Write the open buckets to pi_rollup; safe to call from any thread
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                buckets, self._buckets = self._buckets, {}
+            if not buckets:
+                return
+            try:
+                self.store.executemany(UPSERT, [(step, bucket, *values) for (step, bucket), values in buckets.items()])
+            except Exception:
+                with self._lock:
+                    # Put them back so the next flush tries again
+                    for key, values in buckets.items():
+                        if key in self._buckets:
+                            merge_buckets(values, self._buckets[key])
+                        self._buckets[key] = values
+                raise
+            self.buckets_written += len(buckets)
+
+    def purge(self, now=None):
+        now = time.time() if now is None else now
+        with self.store.transaction() as conn:
+            self.raw_purged += conn.execute(
+                'DELETE FROM pi_data WHERE timestamp < ?', (format_timestamp(now - RAW_RETENTION),)).rowcount
+            for step, retention in RETENTION.items():
+                self.rollups_purged += conn.execute(
+                    'DELETE FROM pi_rollup WHERE step = ? AND bucket < ?', (step, int(now - retention))).rowcount
+        self.last_purge = now
+
+    def _run(self):
+        next_purge = time.time()
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+                if time.time() >= next_purge:
+                    self.purge()
+                    next_purge = time.time() + PURGE_INTERVAL
+            except Exception as e:
+                logging.error(f"Error maintaining telemetry rollups: {e}")
+        try:
+            self.flush()
+        except Exception as e:
+            logging.error(f"Error flushing telemetry rollups: {e}")
+
+    # Chart points between start and end (epoch seconds), step seconds apart.
+    # Served from the 1-minute tier, or the 1-hour tier when the step allows
+    # it or the range reaches past what the 1-minute tier keeps.
+    def history(self, start, end, step=None):
+        step = int(step or default_step(end - start))
+        if step < MINUTE or step % MINUTE:
+            raise ValueError(f'step must be a multiple of {MINUTE} seconds')
+        tier = MINUTE
+        if step % HOUR == 0 or start < time.time() - RETENTION[MINUTE]:
+            tier = HOUR
+            step = max(HOUR, -(-step // HOUR) * HOUR)
+        self.flush()
+        rows = self.store.fetchall(HISTORY, (step, step, tier, int(start // step) * step, int(end)))
+        points = []
+        for row in rows:
+            point = {'timestamp': row[0]}
+            for i, metric in enumerate(METRICS):
+                low, high, total, count = row[1 + i * 4:5 + i * 4]
+                point[metric] = {
+                    'min': low,
+                    'avg': round(total / count, 2) if count else None,
+                    'max': high
+                } if count else None
+            points.append(point)
+        return {'from': start, 'to': end, 'step': step, 'points': points}
+
+    def stats(self):
+        with self._lock:
+            open_buckets = len(self._buckets)
+        return {
+            'samples': self.samples,
+            'unparsed': self.unparsed,
+            'open_buckets': open_buckets,
+            'buckets_written': self.buckets_written,
+            'raw_purged': self.raw_purged,
+            'rollups_purged': self.rollups_purged,
+            'last_purge': self.last_purge
+        }
@@ -1,15 +1,16 @@
 import threading
 import time
-import psutil
 import sqlite3
 from flask import Flask, jsonify
 from flask_cors import CORS
-import requests
 import serial
 import logging
 from datetime import datetime
 import os
 from dotenv import load_dotenv
+from stats_sampler import StatsSampler
+from uplink import Uplink
+from sensor_buffer import SensorBuffer
 
 load_dotenv()
 
@@ -20,11 +21,17 @@ API_KEY = os.getenv('API_KEY', 'default_key')
 
 SERIAL_PORT = '/dev/ttyACM0'  
 BAUD_RATE = 9600
+NEAR_DISTANCE = float(os.getenv('NEAR_DISTANCE', '50'))  # cm; someone arriving is sent without waiting for the batch
+SENSOR_POLICY = os.getenv('SENSOR_POLICY', 'latest')      # latest | decimate | aggregate, see sensor_buffer.py
 
 app = Flask(__name__)
 CORS(app)
 
-def read_sensor_data(ser, data_queue):
+stats_sampler = StatsSampler()
+uplink = Uplink(MAIN_SERVER_URL, API_KEY)
+sensor_buffer = SensorBuffer(SENSOR_POLICY)
+
+def read_sensor_data(ser):
     while True:
         try:
             line = ser.readline().decode('utf-8').strip()
@@ -32,61 +39,33 @@ def read_sensor_data(ser, data_queue):
                 try:
                     distance = float(line)
                     logging.info(f"Received distance: {distance} cm")
-                    data_queue.append(distance)
+                    sensor_buffer.put(distance)
                 except ValueError:
                     logging.warning(f"Invalid data received from Arduino: '{line}'")
         except Exception as e:
             logging.error(f"Error reading from serial port: {e}")
             time.sleep(1) 
 
+# Latest reading from the background sampler; never blocks the sender loop
 def gather_system_stats():
-    cpu_usage = psutil.cpu_percent(interval=1)
-    memory = psutil.virtual_memory()
-    cpu_temp = None
-
-    try:
-        temp = psutil.sensors_temperatures()
-        for name in temp:
-            if 'cpu' in name.lower():
-                cpu_temp = temp[name][0].current
-                break
-    except (AttributeError, NotImplementedError):
-        cpu_temp = None
-
+    stats_sampler.start()
+    sample = stats_sampler.latest()
     return {
-        'cpu_usage': cpu_usage,
-        'memory_usage': memory.percent,
-        'cpu_temp': cpu_temp
+        'cpu_usage': sample['cpu_usage'],
+        'memory_usage': sample['memory_usage'],
+        'cpu_temp': sample['cpu_temp']
     }
 
-def send_data_to_main_server(data):
-    try:
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {API_KEY}' 
-        }
-        response = requests.post(MAIN_SERVER_URL, json=data, headers=headers)
-        if response.status_code == 200:
-            logging.info("Data sent successfully to the main server.")
-        else:
-            logging.error(f"Failed to send data to the main server. Status Code: {response.status_code}, Response: {response.text}")
-    except Exception as e:
-        logging.error(f"Exception while sending data to the main server: {e}")
-
 # Function to collect and send data periodically every second
 def collect_and_send_data(ser):
-    data_queue = []
-    read_thread = threading.Thread(target=read_sensor_data, args=(ser, data_queue), daemon=True)
+    read_thread = threading.Thread(target=read_sensor_data, args=(ser,), daemon=True)
     read_thread.start()
+    was_near = False
 
     while True:
-        # Wait until we have at least one distance measurement
-        while not data_queue:
-            time.sleep(0.1)
-        
-        # Pop the first distance measurement
-        distance = data_queue.pop(0)
-        
+        # Blocks until the reader hands over at least one distance measurement
+        reading = sensor_buffer.take()
+
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         system_stats = gather_system_stats()
 
@@ -95,9 +74,11 @@ def collect_and_send_data(ser):
             'cpu_usage': system_stats['cpu_usage'],
             'memory_usage': system_stats['memory_usage'],
             'cpu_temp': system_stats['cpu_temp'],
-            'sensor_distance': distance
+            **reading
         }
-        send_data_to_main_server(data)
+        near = reading.get('sensor_distance_min', reading['sensor_distance']) <= NEAR_DISTANCE
+        uplink.add(data, urgent=near and not was_near)
+        was_near = near
 
         # Sleep to maintain the 1-second interval
         time.sleep(1)
@@ -105,7 +86,7 @@ def collect_and_send_data(ser):
 # Flask route for status check (optional)
 @app.route('/api/pi_status', methods=['GET'])
 def pi_status():
-    stats = gather_system_stats()
+    stats = stats_sampler.snapshot()
     # For status check, we can assume the latest distance is the most recent in the queue or fetched from the database
     # Here, we'll fetch the latest data from the database
     try:
@@ -129,7 +110,10 @@ def pi_status():
         'cpu_usage': stats['cpu_usage'],
         'memory_usage': stats['memory_usage'],
         'cpu_temp': stats['cpu_temp'],
-        'sensor_distance': sensor_distance
+        'sensor_distance': sensor_distance,
+        'windows': stats['windows'],
+        'uplink': uplink.stats(),
+        'sensor_buffer': sensor_buffer.stats()
     }), 200
 
 if __name__ == '__main__':
@@ -141,6 +125,9 @@ if __name__ == '__main__':
         logging.error(f"Failed to connect to Arduino: {e}")
         exit(1)
 
+    stats_sampler.start()
+    uplink.start()
+
     # Start the data collection and sending thread
     data_thread = threading.Thread(target=collect_and_send_data, args=(ser,), daemon=True)
     data_thread.start()
@@ -0,0 +1,94 @@
+# Bounded hand-off between the serial reader and the sender loop
+#
+# read_sensor_data used to append to a plain list that the sender polled
+# every 100 ms and popped from the front. When the Arduino reports faster
+# than the sender's one sample per second the list grew without bound. Now
+# readings go into a fixed-size deque, the sender blocks on a condition
+# until there is something to take, and a policy decides what it gets:
+#
+#   latest      the newest reading; older ones are discarded
+#   decimate    every Nth reading, oldest first
+#   aggregate   min/mean/max of everything since the last take, kept as
+#               running totals so nothing is ever dropped
+#
+# Every discarded reading is counted by reason for /api/pi_status.
+import threading
+from collections import deque
+
+CAPACITY = 256
+DECIMATE_FACTOR = 5
+POLICIES = ('latest', 'decimate', 'aggregate')
+
+class SensorBuffer:
+    def __init__(self, policy='latest', capacity=CAPACITY, decimate_factor=DECIMATE_FACTOR):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown sensor policy '{policy}', expected one of {POLICIES}")
+        self.policy = policy
+        self.capacity = capacity
+        self.decimate_factor = decimate_factor
+        self.readings = deque(maxlen=capacity)
+        self.received = 0
+        self.delivered = 0
+        self.dropped = {'overflow': 0, 'superseded': 0, 'decimated': 0}
+        self.last = None
+        self._window = None  # aggregate: [min, max, sum, count] since the last take
+        self._condition = threading.Condition()
+
+    def put(self, value):
+        with self._condition:
+            self.received += 1
+            self.last = value
+            if self.policy == 'aggregate':
+                if self._window is None:
+                    self._window = [value, value, 0.0, 0]
+                window = self._window
+                window[0] = min(window[0], value)
+                window[1] = max(window[1], value)
+                window[2] += value
+                window[3] += 1
+                self._condition.notify()
+                return
+            if self.policy == 'decimate' and (self.received - 1) % self.decimate_factor:
+                self.dropped['decimated'] += 1
+                return
+            if len(self.readings) == self.capacity:
+                self.dropped['overflow'] += 1  # deque drops the oldest for us
+            self.readings.append(value)
+            self._condition.notify()
+
+    # Block until a reading is available; returns a dict of sample fields, or
+    # None on timeout. aggregate adds the min, max and count of the window.
+    def take(self, timeout=None):
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.readings or self._window, timeout):
+                return None
+            if self.policy == 'latest':
+                value = self.readings.pop()
+                self.dropped['superseded'] += len(self.readings)
+                self.readings.clear()
+                self.delivered += 1
+                return {'sensor_distance': value}
+            if self.policy == 'decimate':
+                self.delivered += 1
+                return {'sensor_distance': self.readings.popleft()}
+            low, high, total, count = self._window
+            self._window = None
+            self.delivered += count
+        return {
+            'sensor_distance': total / count,
+            'sensor_distance_min': low,
+            'sensor_distance_max': high,
+            'sensor_readings': count
+        }
+
+    def stats(self):
+        with self._condition:
+            return {
+                'policy': self.policy,
+                'capacity': self.capacity,
+                'queued': self._window[3] if self._window else len(self.readings),
+                'received': self.received,
+                'delivered': self.delivered,
+                'dropped': dict(self.dropped),
+                'last': self.last
+            }
@@ -0,0 +1,189 @@
+# Batched, compressed telemetry uplink to the main server
+#
+# The agent used to make one requests.post per reading, opening a new
+# connection every time and dropping the reading if the server was down.
+# Samples are now collected into batches and posted as gzip'd JSON over one
+# keep-alive session. A batch that can't be delivered goes into an on-disk
+# spool (SQLite, so it survives restarts and partial writes), and the spool
+# is replayed oldest first once the server answers again.
+import gzip
+import json
+import time
+import sqlite3
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+BATCH_SIZE = 10              # samples per request
+FLUSH_INTERVAL = 10.0        # seconds a sample may wait for its batch to fill
+REQUEST_TIMEOUT = (3, 10)    # connect, read
+SPOOL_PATH = 'uplink_spool.db'
+MAX_SPOOLED = 100000         # about a day at one sample per second; oldest go first past this
+REPLAY_BATCHES = 20          # batches replayed per pass, so new samples aren't starved
+
+class Spool:
+    def __init__(self, path=SPOOL_PATH, max_samples=MAX_SPOOLED):
+        self.max_samples = max_samples
+        self.evicted = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS spool (id INTEGER PRIMARY KEY AUTOINCREMENT, sample TEXT NOT NULL)')
+
+    def push(self, samples):
+        with self._lock:
+            with self._conn:
+                self._conn.executemany('INSERT INTO spool (sample) VALUES (?)', [(json.dumps(s),) for s in samples])
+                excess = self._count() - self.max_samples
+                if excess > 0:
+                    self._conn.execute('DELETE FROM spool WHERE id IN (SELECT id FROM spool ORDER BY id LIMIT ?)', (excess,))
+                    self.evicted += excess
+
+    # Oldest samples first, as (last_id, samples); pass last_id to remove() once they are delivered
+    def peek(self, limit):
+        with self._lock:
+            rows = self._conn.execute('SELECT id, sample FROM spool ORDER BY id LIMIT ?', (limit,)).fetchall()
+        if not rows:
+            return None, []
+        return rows[-1][0], [json.loads(sample) for _, sample in rows]
+
+    def remove(self, last_id):
+        with self._lock:
+            with self._conn:
+                self._conn.execute('DELETE FROM spool WHERE id <= ?', (last_id,))
+
+    def _count(self):
+        return self._conn.execute('SELECT COUNT(*) FROM spool').fetchone()[0]
+
+    def count(self):
+        with self._lock:
+            return self._count()
+
+class Uplink:
+    def __init__(self, url, api_key, spool=None, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.url = url
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spool = spool if spool is not None else Spool()
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self.session.headers.update({
+            'Content-Type': 'application/json',
+            'Content-Encoding': 'gzip',
+            'Authorization': f'Bearer {api_key}'
+        })
+        self.online = True
+        self.sent = 0
+        self.spooled = 0
+        self.failures = 0
+        self.rejected = 0
+        self.bytes_sent = 0
+        self.last_latency = None
+        self._pending = []
+        self._oldest = None
+        self._urgent = False
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='uplink', daemon=True)
+                self._thread.start()
+
+    # Queue one sample; urgent sends the batch now instead of waiting for it to fill
+    def add(self, sample, urgent=False):
+        with self._condition:
+            if not self._pending:
+                self._oldest = time.time()
+            self._pending.append(sample)
+            self._urgent = self._urgent or urgent
+            if self._urgent or len(self._pending) >= self.batch_size:
+                self._condition.notify()
+
+    def _take_batch(self):
+        with self._condition:
+            while True:
+                if self._pending:
+                    if self._urgent or len(self._pending) >= self.batch_size:
+                        break
+                    remaining = self._oldest + self.flush_interval - time.time()
+                    if remaining <= 0:
+                        break
+                else:
+                    remaining = None
+                self._condition.wait(remaining)
+            batch, self._pending, self._urgent = self._pending, [], False
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            # Spooled samples go first so the server receives samples in time
+            # order; while offline this doubles as the reconnect probe
+            if self._replay() and self._post(batch):
+                continue
+            self.spool.push(batch)
+            self.spooled += len(batch)
+
+    # Send what was spooled while offline, a bounded amount per pass; True
+    # once the spool is empty
+    def _replay(self):
+        for _ in range(REPLAY_BATCHES):
+            last_id, samples = self.spool.peek(self.batch_size * 10)
+            if not samples:
+                return True
+            if not self._post(samples):
+                return False
+            self.spool.remove(last_id)
+            logging.info(f"Replayed {len(samples)} spooled samples.")
+        return self.spool.count() == 0
+
+    # sent_at is written like the samples' own timestamps (the Pi's local
+    # time), so the server can tell a live batch from a spool replay by
+    # comparing the two without trusting either clock
+    def _post(self, samples):
+        payload = {'samples': samples, 'sent_at': time.strftime('%Y-%m-%d %H:%M:%S')}
+        body = gzip.compress(json.dumps(payload).encode('utf-8'))
+        started = time.time()
+        try:
+            response = self.session.post(self.url, data=body, timeout=REQUEST_TIMEOUT)
+        except requests.RequestException as e:
+            return self._failed(f"Exception while sending data to the main server: {e}")
+        if 400 <= response.status_code < 500 and response.status_code not in (408, 429):
+            # The server will never accept this batch; retrying it would block the spool
+            logging.error(f"Main server rejected {len(samples)} samples. Status Code: {response.status_code}, Response: {response.text}")
+            self.rejected += len(samples)
+            return True
+        if response.status_code != 200:
+            return self._failed(f"Failed to send data to the main server. Status Code: {response.status_code}, Response: {response.text}")
+        self.last_latency = time.time() - started
+        self.online = True
+        self.sent += len(samples)
+        self.bytes_sent += len(body)
+        return True
+
+    def _failed(self, message):
+        if self.online:
+            logging.error(message)  # once per outage, not once per retry
+        self.online = False
+        self.failures += 1
+        return False
+
+    def stats(self):
+        with self._condition:
+            pending = len(self._pending)
+        return {
+            'online': self.online,
+            'sent': self.sent,
+            'pending': pending,
+            'spooled': self.spool.count(),
+            'spooled_total': self.spooled,
+            'spool_evicted': self.spool.evicted,
+            'failures': self.failures,
+            'rejected': self.rejected,
+            'bytes_sent': self.bytes_sent,
+            'last_latency': None if self.last_latency is None else round(self.last_latency, 4)
+        }
@@ -0,0 +1,108 @@
+# Shared SQLite access for assistant.db
+#
+# Connections are opened once, tuned for concurrent readers (WAL) and handed
+# out per thread from a small pool, so the helpers in main.py stop paying a
+# connect/close on every call and no longer trip "database is locked" when the
+# Pi ingest and dashboard polls overlap.
+import sqlite3
+import threading
+import queue
+from contextlib import contextmanager
+
+DB_PATH = 'assistant.db'
+POOL_SIZE = 8
+BUSY_TIMEOUT_MS = 5000
+# sqlite3 keeps compiled statements per connection keyed by SQL text, so as
+# long as the helpers use fixed SQL with ? parameters they are only prepared once
+STATEMENT_CACHE_SIZE = 128
+
+_pool = queue.LifoQueue(maxsize=POOL_SIZE)
+_local = threading.local()
+
+def _open_connection():
+    conn = sqlite3.connect(
+        DB_PATH,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        isolation_level=None  # we manage transactions ourselves below
+    )
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA cache_size=-8000')  # ~8 MB page cache
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+    return conn
+
+# Check a connection out for the current thread; nested use reuses the same one
+@contextmanager
+def connection():
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        yield conn
+        return
+
+    try:
+        conn = _pool.get_nowait()
+    except queue.Empty:
+        conn = _open_connection()
+    _local.conn = conn
+    _local.depth = 0
+    try:
+        yield conn
+    finally:
+        _local.conn = None
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            _pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+# Run a block atomically; only the outermost transaction commits
+@contextmanager
+def transaction():
+    with connection() as conn:
+        if _local.depth:
+            _local.depth += 1
+            try:
+                yield conn
+            finally:
+                _local.depth -= 1
+            return
+
+        _local.depth = 1
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+        finally:
+            _local.depth = 0
+
+def execute(sql, params=()):
+    with transaction() as conn:
+        return conn.execute(sql, params).lastrowid
+
+def executemany(sql, seq_of_params):
+    with transaction() as conn:
+        return conn.executemany(sql, seq_of_params).rowcount
+
+def fetchone(sql, params=()):
+    with connection() as conn:
+        return conn.execute(sql, params).fetchone()
+
+def fetchall(sql, params=()):
+    with connection() as conn:
+        return conn.execute(sql, params).fetchall()
+
+# Close pooled connections, e.g. on shutdown
+def close_all():
+    while True:
+        try:
+            _pool.get_nowait().close()
+        except queue.Empty:
+            break
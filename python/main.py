@@ -2,9 +2,10 @@ import threading
 import time
 import speech_recognition as sr
 import os
-import psutil
-import subprocess
-import sqlite3
+import db
+from stats_sampler import StatsSampler, DEFAULT_WINDOWS
+from response_cache import ResponseCache, make_key, is_real_time
+from semantic_cache import SemanticCache
 from flask import Flask, render_template, request, jsonify, Response
 from flask_cors import CORS
 from g4f import ChatCompletion
@@ -20,42 +21,50 @@ last_activation_time = 0
 kill_switch_activated = False
 current_speech = ""
 tts_lock = threading.Lock()  
+stats_sampler = StatsSampler()  # keeps /api/status from blocking on cpu_percent
+response_cache = ResponseCache(store=db)  # repeated prompts skip the LLM
+
+LLM_MODEL = "gpt-4o"
+# Cosine similarity a new prompt needs with an earlier one to reuse its answer
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.9'))
+semantic_cache = SemanticCache(threshold=SEMANTIC_CACHE_THRESHOLD)
 
 def init_db():
-    conn = sqlite3.connect('assistant.db')
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS settings (
-            id INTEGER PRIMARY KEY,
-            wake_word TEXT,
-            voice_enabled INTEGER,
-            assistant_personality TEXT
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS chat_history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user TEXT,
-            assistant TEXT
-        )
-    ''')
-    c.execute('SELECT COUNT(*) FROM settings')
-    if c.fetchone()[0] == 0:
+    with db.transaction() as conn:
+        c = conn.cursor()
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS settings (
+                id INTEGER PRIMARY KEY,
+                wake_word TEXT,
+                voice_enabled INTEGER,
+                assistant_personality TEXT
+            )
+        ''')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS chat_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user TEXT,
+                assistant TEXT
+            )
+        ''')
         c.execute('''
-            INSERT INTO settings (id, wake_word, voice_enabled, assistant_personality)
-            VALUES (?, ?, ?, ?)
-        ''', (1, 'hello', 1, 'Default'))
-    conn.commit()
-    conn.close()
+            CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        ''')
+        c.execute('SELECT COUNT(*) FROM settings')
+        if c.fetchone()[0] == 0:
+            c.execute('''
+                INSERT INTO settings (id, wake_word, voice_enabled, assistant_personality)
+                VALUES (?, ?, ?, ?)
+            ''', (1, 'hello', 1, 'Default'))
 
 init_db()
 
 def get_settings():
-    conn = sqlite3.connect('assistant.db')
-    c = conn.cursor()
-    c.execute('SELECT wake_word, voice_enabled, assistant_personality FROM settings WHERE id = 1')
-    result = c.fetchone()
-    conn.close()
+    result = db.fetchone('SELECT wake_word, voice_enabled, assistant_personality FROM settings WHERE id = 1')
     if result:
         wake_word, voice_enabled, assistant_personality = result
         return {
@@ -71,54 +80,36 @@ def get_settings():
         }
 
 def update_settings_in_db(wake_word, voice_enabled, assistant_personality):
-    conn = sqlite3.connect('assistant.db')
-    c = conn.cursor()
-    c.execute('''
+    db.execute('''
         UPDATE settings
         SET wake_word = ?, voice_enabled = ?, assistant_personality = ?
         WHERE id = 1
     ''', (wake_word, int(voice_enabled), assistant_personality))
-    conn.commit()
-    conn.close()
 
 def add_to_chat_history(user_text, assistant_response):
-    conn = sqlite3.connect('assistant.db')
-    c = conn.cursor()
-    c.execute('''
+    db.execute('''
         INSERT INTO chat_history (user, assistant)
         VALUES (?, ?)
     ''', (user_text, assistant_response))
-    conn.commit()
-    conn.close()
 
 def get_chat_history():
-    conn = sqlite3.connect('assistant.db')
-    c = conn.cursor()
-    c.execute('SELECT user, assistant FROM chat_history ORDER BY id')
-    rows = c.fetchall()
-    conn.close()
+    rows = db.fetchall('SELECT user, assistant FROM chat_history ORDER BY id')
     chat_history = [{'user': row[0], 'assistant': row[1]} for row in rows]
     return chat_history
 
-def get_system_stats():
-    cpu_usage = psutil.cpu_percent(interval=1)
-    memory = psutil.virtual_memory()
-    cpu_temp = 'Unavailable'
+def get_system_stats(windows=DEFAULT_WINDOWS):
+    stats_sampler.start()
+    stats = stats_sampler.snapshot(windows)
+    if stats['cpu_temp'] is None:
+        stats['cpu_temp'] = 'Unavailable'
+    return stats
 
-    try:
-        temp = psutil.sensors_temperatures()
-        for name in temp:
-            if 'cpu' in name.lower():
-                cpu_temp = temp[name][0].current
-                break
-    except (AttributeError, NotImplementedError):
-        cpu_temp = 'Unavailable'
-
-    return {
-        'cpu_usage': cpu_usage,
-        'memory_usage': memory.percent,
-        'cpu_temp': cpu_temp
-    }
+# Parse an optional ?windows=10,60 query argument into summary window sizes
+def parse_stats_windows():
+    windows = request.args.get('windows')
+    if not windows:
+        return DEFAULT_WINDOWS
+    return tuple(int(w) for w in windows.split(',') if w.strip())
 
 def ai_process(text):
     try:
@@ -132,8 +123,20 @@ def ai_process(text):
         elif assistant_personality == "Professional":
             personality_prefix = "You are a professional assistant. "
 
+        # Repeated questions are answered from the cache instead of the LLM
+        cache_key = None
+        if not is_real_time(text):
+            cache_key = make_key(text, assistant_personality, LLM_MODEL)
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                return cached
+            # Then near-duplicates of earlier questions ("what's your name" / "what is your name")
+            cached = semantic_cache.lookup(text, assistant_personality, LLM_MODEL)
+            if cached is not None:
+                return cached
+
         response = ChatCompletion.create(
-            model="gpt-4o",
+            model=LLM_MODEL,
             messages=[
                 {"role": "user", "content": personality_prefix + text}
             ],
@@ -141,6 +144,9 @@ def ai_process(text):
         )
 
         message = response.strip()
+        if cache_key is not None:
+            response_cache.put(cache_key, message)
+            semantic_cache.add(text, assistant_personality, LLM_MODEL, message)
 
         return message
     except Exception as e:
@@ -236,7 +242,11 @@ def index():
 
 @app.route('/api/status', methods=['GET'])
 def get_status():
-    stats = get_system_stats()
+    try:
+        windows = parse_stats_windows()
+    except ValueError:
+        return jsonify({'error': 'Invalid windows parameter'}), 400
+    stats = get_system_stats(windows)
     chat_history = get_chat_history()
     settings = get_settings()
     return jsonify({
@@ -244,7 +254,9 @@ def get_status():
         'assistant_active': assistant_active,
         'stats': stats,
         'chat_history': chat_history,
-        'settings': settings
+        'settings': settings,
+        'response_cache': response_cache.stats(),
+        'semantic_cache': semantic_cache.stats()
     })
 
 @app.route('/api/kill', methods=['POST'])
@@ -279,6 +291,9 @@ def start_server():
     app.run(host='0.0.0.0', port=5000, use_reloader=False)
 
 if __name__ == '__main__':
+    stats_sampler.start()
+    response_cache.purge_expired()
+
     listen_thread = threading.Thread(target=listen_loop, daemon=True)
     listen_thread.start()
 